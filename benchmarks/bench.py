@@ -0,0 +1,219 @@
+#!/usr/bin/env python3
+"""
+benchmark the lookups and modules of this collection against a stand-in for `bw` (benchmarks/bin/bw)
+every scenario is an ansible-playbook run on localhost, with one host per fork
+lookup latency comes from the unity.bitwarden.stats callback, throughput is lookups per second of wall time
+
+example:
+  ./benchmarks/bench.py --forks 1,10 --scenarios lookup --latency 0.1
+  BITWARDEN_BACKEND=pool ./benchmarks/bench.py --json pool.json
+"""
+
+import os
+import sys
+import grp
+import json
+import time
+import shutil
+import getpass
+import argparse
+import tempfile
+import subprocess
+
+BENCHMARKS_DIR = os.path.dirname(os.path.abspath(__file__))
+COLLECTION_DIR = os.path.dirname(BENCHMARKS_DIR)
+SCENARIOS = ["lookup", "attachment", "write"]
+CACHE_STATES = ["cold", "warm"]
+
+
+def parse_list(value: str, item_type=str) -> list:
+    return [item_type(x) for x in value.split(",") if x]
+
+
+def make_vault(vault_size: int, attachment_sizes: list) -> dict:
+    items = []
+    for i in range(vault_size):
+        items.append(
+            {
+                "object": "item",
+                "id": f"id-{i}",
+                "name": f"bench-{i}",
+                "notes": None,
+                "collectionIds": [],
+                "fields": [],
+                "login": {"username": f"user-{i}", "password": f"password-{i}"},
+                "attachments": [
+                    {"id": f"attachment-{i}-{size}", "fileName": f"file-{size}.bin", "size": str(size)}
+                    for size in attachment_sizes
+                ],
+            }
+        )
+    return {"items": items}
+
+
+def setup_workdir(workdir: str, vault_size: int, attachment_sizes: list) -> None:
+    collection_link = os.path.join(workdir, "collections", "ansible_collections", "unity", "bitwarden")
+    os.makedirs(os.path.dirname(collection_link), exist_ok=True)
+    if not os.path.islink(collection_link):
+        os.symlink(COLLECTION_DIR, collection_link)
+    with open(os.path.join(workdir, "vault.json"), "w") as vault_fd:
+        json.dump(make_vault(vault_size, attachment_sizes), vault_fd)
+    appdata_dir = os.path.join(workdir, "appdata")
+    os.makedirs(appdata_dir, exist_ok=True)
+    with open(os.path.join(appdata_dir, "data.json"), "w") as data_fd:
+        json.dump({"user_bench_vaultSync_lastSync": "2000-01-01T00:00:00.000Z"}, data_fd)
+
+
+def make_inventory(workdir: str, forks: int) -> str:
+    inventory_path = os.path.join(workdir, f"inventory-{forks}.ini")
+    with open(inventory_path, "w") as inventory_fd:
+        inventory_fd.write("[all]\n")
+        for i in range(forks):
+            inventory_fd.write(
+                f"bench-host-{i} ansible_connection=local ansible_python_interpreter={sys.executable}"
+                f" bench_host_index={i}\n"
+            )
+    return inventory_path
+
+
+def make_env(workdir: str, forks: int, latency: float) -> dict:
+    """
+    environment for ansible-playbook, with the stand-in `bw` first in PATH
+    """
+    env = {
+        **os.environ,
+        "PATH": os.path.join(BENCHMARKS_DIR, "bin") + os.pathsep + os.environ["PATH"],
+        "ANSIBLE_COLLECTIONS_PATH": os.path.join(workdir, "collections"),
+        "ANSIBLE_FORKS": str(forks),
+        "RAMDISK_CACHE_PATH": os.path.join(workdir, "cache"),
+        "BITWARDENCLI_APPDATA_DIR": os.path.join(workdir, "appdata"),
+        "BENCH_BW_VAULT": os.path.join(workdir, "vault.json"),
+        "BENCH_BW_LATENCY": str(latency),
+        "BW_SESSION": os.environ.get("BW_SESSION", "bench"),
+    }
+    os.makedirs(env["RAMDISK_CACHE_PATH"], exist_ok=True)
+    return env
+
+
+def run_playbook(workdir: str, scenario: str, forks: int, extra_vars: dict, latency: float) -> dict:
+    stats_path = os.path.join(workdir, "stats.json")
+    if os.path.exists(stats_path):
+        os.remove(stats_path)
+    env = {
+        **make_env(workdir, forks, latency),
+        "ANSIBLE_CALLBACKS_ENABLED": "unity.bitwarden.stats",
+        "UNITY_BITWARDEN_STATS_OUTPUT_PATH": stats_path,
+    }
+    command = [
+        "ansible-playbook",
+        "-i",
+        make_inventory(workdir, forks),
+        "-e",
+        json.dumps(extra_vars),
+        os.path.join(BENCHMARKS_DIR, f"{scenario}.yml"),
+    ]
+    start = time.perf_counter()
+    proc = subprocess.run(command, env=env, stdout=subprocess.PIPE, stderr=subprocess.STDOUT, text=True)
+    wall_seconds = time.perf_counter() - start
+    if proc.returncode != 0:
+        sys.exit(f"benchmark playbook failed: {command}\n{proc.stdout}")
+    with open(stats_path, "r") as stats_fd:
+        summary = json.load(stats_fd)
+    return {"wall_seconds": wall_seconds, "summary": summary}
+
+
+def run_scenario(args, workdir: str, scenario: str, forks: int, cache_state: str, attachment_size) -> dict:
+    extra_vars = {
+        "bench_vault_size": args.vault_size,
+        "bench_lookups": args.lookups_per_host,
+        "bench_out_dir": os.path.join(workdir, "out"),
+        "bench_owner": getpass.getuser(),
+        "bench_group": grp.getgrgid(os.getgid()).gr_name,
+    }
+    if attachment_size is not None:
+        extra_vars["bench_attachment"] = f"file-{attachment_size}.bin"
+    os.makedirs(extra_vars["bench_out_dir"], exist_ok=True)
+    cache_dir = os.path.join(workdir, "cache")
+    shutil.rmtree(cache_dir, ignore_errors=True)
+    if cache_state == "warm":
+        run_playbook(workdir, scenario, forks, extra_vars, args.latency)
+    result = run_playbook(workdir, scenario, forks, extra_vars, args.latency)
+    summary = result["summary"]
+    lookup_histogram = summary["histograms"].get("lookup", {})
+    bw_calls = sum(h["count"] for name, h in summary["histograms"].items() if name.startswith("bw "))
+    return {
+        "scenario": scenario,
+        "forks": forks,
+        "cache": cache_state,
+        "attachment_size": attachment_size,
+        "lookups": summary["lookups"],
+        "wall_seconds": result["wall_seconds"],
+        "lookups_per_second": summary["lookups"] / result["wall_seconds"],
+        "p50_ms": lookup_histogram.get("p50", 0) * 1000,
+        "p99_ms": lookup_histogram.get("p99", 0) * 1000,
+        "bw_calls": bw_calls,
+        "hit_ratio": summary["hit_ratio"],
+    }
+
+
+def format_row(row: dict) -> str:
+    return "{:<11} {:>5} {:<5} {:>10} {:>7} {:>8.2f} {:>9.1f} {:>9.2f} {:>9.2f} {:>8}".format(
+        row["scenario"],
+        row["forks"],
+        row["cache"],
+        "-" if row["attachment_size"] is None else row["attachment_size"],
+        row["lookups"],
+        row["wall_seconds"],
+        row["lookups_per_second"],
+        row["p50_ms"],
+        row["p99_ms"],
+        row["bw_calls"],
+    )
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--scenarios", type=parse_list, default=SCENARIOS, help="comma separated")
+    parser.add_argument("--forks", type=lambda x: parse_list(x, int), default=[1, 10, 50, 200], help="comma separated")
+    parser.add_argument("--caches", type=parse_list, default=CACHE_STATES, help="comma separated: cold,warm")
+    parser.add_argument(
+        "--attachment-sizes",
+        type=lambda x: parse_list(x, int),
+        default=[1024, 1048576],
+        help="comma separated, in bytes",
+    )
+    parser.add_argument("--vault-size", type=int, default=100, help="number of items in the vault")
+    parser.add_argument("--latency", type=float, default=0.5, help="seconds that each `bw` command takes")
+    parser.add_argument("--lookups-per-host", type=int, default=5)
+    parser.add_argument("--workdir", help="default: a new temporary directory, removed afterwards")
+    parser.add_argument("--json", help="also write the results to this file as JSON")
+    args = parser.parse_args()
+
+    workdir = args.workdir or tempfile.mkdtemp(prefix="unity.bitwarden.bench.")
+    os.makedirs(workdir, exist_ok=True)
+    setup_workdir(workdir, args.vault_size, args.attachment_sizes)
+    print(
+        "{:<11} {:>5} {:<5} {:>10} {:>7} {:>8} {:>9} {:>9} {:>9} {:>8}".format(
+            "scenario", "forks", "cache", "attachment", "lookups", "wall_s", "lookups/s", "p50_ms", "p99_ms", "bw_calls"
+        )
+    )
+    rows = []
+    try:
+        for scenario in args.scenarios:
+            attachment_sizes = [None] if scenario == "lookup" else args.attachment_sizes
+            for attachment_size in attachment_sizes:
+                for forks in args.forks:
+                    for cache_state in args.caches:
+                        row = run_scenario(args, workdir, scenario, forks, cache_state, attachment_size)
+                        print(format_row(row), flush=True)
+                        rows.append(row)
+    finally:
+        if args.workdir is None:
+            shutil.rmtree(workdir, ignore_errors=True)
+    if args.json:
+        with open(args.json, "w") as json_fd:
+            json.dump(rows, json_fd, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,134 @@
+#!/usr/bin/env python3
+"""
+check that the lookups and modules of this collection return the right content with every backend,
+against the stand-in for `bw` (benchmarks/bin/bw), whose `bw serve` is a stub of the REST API of the real one
+each host looks up one item and one missing item, and writes its attachments to files, which are compared with the stand-in vault
+
+with the serve backend, the stub first resets the connection in the middle of an attachment download
+that playbook run may fail, but it must not cache a truncated or doubled attachment, which the next run would use
+
+example:
+  ./benchmarks/check.py
+  ./benchmarks/check.py --backends serve --forks 20
+"""
+
+import os
+import sys
+import grp
+import json
+import shutil
+import getpass
+import argparse
+import tempfile
+import subprocess
+import importlib.util
+import importlib.machinery
+
+from bench import BENCHMARKS_DIR, make_env, make_inventory, parse_list, setup_workdir
+
+BACKENDS = ["cli", "pool", "serve"]
+
+
+def load_stand_in_bw():
+    """
+    benchmarks/bin/bw has no .py suffix, so it is loaded by path
+    """
+    path = os.path.join(BENCHMARKS_DIR, "bin", "bw")
+    loader = importlib.machinery.SourceFileLoader("stand_in_bw", path)
+    spec = importlib.util.spec_from_loader(loader.name, loader)
+    module = importlib.util.module_from_spec(spec)
+    loader.exec_module(module)
+    return module
+
+
+def run_check_playbook(workdir: str, backend: str, forks: int, extra_vars: dict, extra_env: dict) -> tuple:
+    """
+    returns (exit code, output)
+    """
+    env = {**make_env(workdir, forks, latency=0), "BITWARDEN_BACKEND": backend, **extra_env}
+    command = [
+        "ansible-playbook",
+        "-i",
+        make_inventory(workdir, forks),
+        "-e",
+        json.dumps(extra_vars),
+        os.path.join(BENCHMARKS_DIR, "check.yml"),
+    ]
+    proc = subprocess.run(command, env=env, stdout=subprocess.PIPE, stderr=subprocess.STDOUT, text=True)
+    return proc.returncode, proc.stdout
+
+
+def get_errors(out_dir: str, forks: int, vault_size: int, attachment_sizes: list) -> list:
+    """
+    each host writes its largest attachment as base64 and as gzip+base64, and every attachment with attachment_glob
+    """
+    stand_in_bw = load_stand_in_bw()
+    errors = []
+    for i in range(forks):
+        item_id = f"id-{i % vault_size}"
+        expected_files = {f"glob-file-{size}.bin": size for size in attachment_sizes}
+        for variant in ["base64", "gzip"]:
+            expected_files[f"{variant}-file-{max(attachment_sizes)}.bin"] = max(attachment_sizes)
+        for name, size in expected_files.items():
+            path = os.path.join(out_dir, f"bench-host-{i}-{name}")
+            filename = name.split("-", 1)[1]
+            try:
+                with open(path, "rb") as fd:
+                    content = fd.read()
+            except FileNotFoundError:
+                errors.append(f"missing: {path}")
+                continue
+            if content != stand_in_bw.make_attachment_content(item_id, filename, size):
+                errors.append(f"wrong content: {path}")
+    return errors
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--backends", type=parse_list, default=BACKENDS, help="comma separated")
+    parser.add_argument("--forks", type=int, default=4)
+    parser.add_argument("--vault-size", type=int, default=10, help="number of items in the vault")
+    parser.add_argument(
+        "--attachment-sizes",
+        type=lambda x: parse_list(x, int),
+        default=[1024, 1048576],
+        help="comma separated, in bytes",
+    )
+    args = parser.parse_args()
+
+    workdir = tempfile.mkdtemp(prefix="unity.bitwarden.check.")
+    failed = False
+    try:
+        setup_workdir(workdir, args.vault_size, args.attachment_sizes)
+        for backend in args.backends:
+            out_dir = os.path.join(workdir, "out")
+            shutil.rmtree(out_dir, ignore_errors=True)
+            shutil.rmtree(os.path.join(workdir, "cache"), ignore_errors=True)
+            os.makedirs(out_dir)
+            extra_vars = {
+                "bench_vault_size": args.vault_size,
+                "bench_out_dir": out_dir,
+                "bench_owner": getpass.getuser(),
+                "bench_group": grp.getgrgid(os.getgid()).gr_name,
+                # the largest attachment is downloaded first, so that a reset is in the middle of a long body
+                "bench_attachment": f"file-{max(args.attachment_sizes)}.bin",
+            }
+            if backend == "serve":
+                # allowed to fail
+                reset_env = {"BENCH_BW_SERVE_RESET_ATTACHMENTS": "1"}
+                run_check_playbook(workdir, backend, args.forks, extra_vars, reset_env)
+            returncode, output = run_check_playbook(workdir, backend, args.forks, extra_vars, {})
+            if returncode != 0:
+                sys.exit(f"check playbook failed with backend {backend}:\n{output}")
+            errors = get_errors(out_dir, args.forks, args.vault_size, args.attachment_sizes)
+            print(f"{backend}: {'ok' if not errors else 'FAILED'}", flush=True)
+            for error in errors:
+                print(f"  {error}")
+            failed = failed or bool(errors)
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+    sys.exit(1 if failed else 0)
+
+
+if __name__ == "__main__":
+    main()
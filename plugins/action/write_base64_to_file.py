@@ -0,0 +1,83 @@
+"""
+controller side of unity.bitwarden.write_base64_to_file
+the remote file is checked with ansible.builtin.stat first. if it already has the same checksum, owner,
+group and mode, the module is not run at all. otherwise the decoded content is transferred as a file
+and the module reads it from there, rather than receiving the base64 content inside its arguments.
+with a compressed `content_encoding`, the compressed bytes are transferred, and the module decompresses them.
+the checksum of the decompressed content is computed here in chunks, without keeping all of it in memory.
+"""
+
+import io
+import base64
+import hashlib
+import binascii
+
+from ansible.plugins.action import ActionBase
+
+from ansible_collections.unity.bitwarden.plugins.module_utils.content_encoding import (
+    is_supported,
+    iter_decompressed,
+)
+
+
+class ActionModule(ActionBase):
+
+    TRANSFERS_FILES = True
+
+    def run(self, tmp=None, task_vars=None):
+        if task_vars is None:
+            task_vars = {}
+        result = super().run(tmp, task_vars)
+        del tmp  # tmp no longer has any effect
+
+        module_args = self._task.args.copy()
+        if "content" not in module_args:
+            # let the module report missing arguments
+            result.update(self._execute_module(module_args=module_args, task_vars=task_vars))
+            self._remove_tmp_path(self._connection._shell.tmpdir)
+            return result
+        try:
+            content_bytes = base64.b64decode(module_args.pop("content"))
+        except (binascii.Error, TypeError):
+            result.update(failed=True, msg="content is not valid base64!")
+            return result
+        content_encoding = module_args.get("content_encoding", "base64")
+        if content_encoding == "base64":
+            content_sha1 = hashlib.sha1(content_bytes).hexdigest()
+        elif not is_supported(content_encoding):
+            # no zstd library on the controller to check the remote file first. the remote host may still have one
+            content_sha1 = None
+        else:
+            sha1 = hashlib.sha1()
+            try:
+                for chunk in iter_decompressed(io.BytesIO(content_bytes), content_encoding):
+                    sha1.update(chunk)
+            except ValueError as e:
+                result.update(failed=True, msg=str(e))
+                return result
+            content_sha1 = sha1.hexdigest()
+
+        try:
+            dest_stat = self._execute_remote_stat(
+                module_args.get("dest"), all_vars=task_vars, follow=True, checksum=True
+            )
+            if (
+                content_sha1 is not None
+                and dest_stat["exists"]
+                and dest_stat.get("isreg")
+                and dest_stat["checksum"] == content_sha1
+                and dest_stat.get("pw_name") == module_args.get("owner")
+                and dest_stat.get("gr_name") == module_args.get("group")
+                and dest_stat.get("mode") == module_args.get("mode")
+            ):
+                result["changed"] = False
+                return result
+
+            tmp_src = self._connection._shell.join_path(self._connection._shell.tmpdir, ".source")
+            self._transfer_data(tmp_src, content_bytes)
+            self._fixup_perms2((self._connection._shell.tmpdir, tmp_src))
+            module_args["src"] = tmp_src
+            result.update(self._execute_module(module_args=module_args, task_vars=task_vars))
+        finally:
+            self._remove_tmp_path(self._connection._shell.tmpdir)
+        return result
@@ -0,0 +1,119 @@
+DOCUMENTATION = """
+  name: stats
+  author: Simon Leary <simon.leary42@proton.me>
+  type: aggregate
+  short_description: summary of bitwarden lookups and their cache at the end of the playbook
+  version_added: 2.17.3
+  description:
+    - while this callback is enabled, every fork appends events to a stats file on the ramdisk
+    - events are cache hits and misses, time spent waiting for locks, time spent in `bw`, and bytes read and written
+    - at the end of the playbook, the events are summarized with counters and histograms, and the stats file is removed
+  requirements:
+    - enable in configuration, for example C(callbacks_enabled = unity.bitwarden.stats) in the C(defaults) ini section
+  options:
+    format:
+      description: print the summary as text, or as a single line of JSON
+      type: str
+      choices: [text, json]
+      default: text
+      ini:
+        - section: callback_unity_bitwarden_stats
+          key: format
+      env:
+        - name: UNITY_BITWARDEN_STATS_FORMAT
+    output_path:
+      description: write the summary as JSON to this file as well
+      type: path
+      ini:
+        - section: callback_unity_bitwarden_stats
+          key: output_path
+      env:
+        - name: UNITY_BITWARDEN_STATS_OUTPUT_PATH
+    cache_path:
+      description:
+        - directory for the stats file. ignore /dev/shm or ~/tmpdisk/shm and use this directory instead
+        - same setting as O(unity.bitwarden.bitwarden#lookup:cache_path)
+      type: str
+      ini:
+        - section: ramdisk_cache
+          key: path
+      env:
+        - name: RAMDISK_CACHE_PATH
+"""
+
+import os
+import json
+import getpass
+
+from ansible.plugins.callback import CallbackBase
+
+from ansible_collections.unity.bitwarden.plugins.plugin_utils import stats
+from ansible_collections.unity.bitwarden.plugins.plugin_utils.ramdisk_cached_lookup import get_ramdisk_path
+
+
+def format_summary(summary: dict) -> str:
+    lines = []
+    counters = summary["counters"]
+    lines.append(f"bitwarden lookups: {summary['lookups']}")
+    if summary["hit_ratio"] is not None:
+        lines.append(f"  hit ratio: {summary['hit_ratio']:.1%}")
+    for name, value in sorted(counters.items()):
+        lines.append(f"  {name}: {value}")
+    lines.append(f"  cache size (bytes): {summary['cache_bytes']}")
+    for name, histogram in summary["histograms"].items():
+        lines.append(
+            "  {} (seconds): count={} sum={:.3f} min={:.3f} p50={:.3f} p99={:.3f} max={:.3f}".format(
+                name,
+                histogram["count"],
+                histogram["sum"],
+                histogram["min"],
+                histogram["p50"],
+                histogram["p99"],
+                histogram["max"],
+            )
+        )
+    return "\n".join(lines)
+
+
+class CallbackModule(CallbackBase):
+    CALLBACK_VERSION = 2.0
+    CALLBACK_TYPE = "aggregate"
+    CALLBACK_NAME = "unity.bitwarden.stats"
+    CALLBACK_NEEDS_ENABLED = True
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.stats_path = None
+
+    def v2_playbook_on_start(self, playbook):
+        """
+        create the stats file and tell the forks about it. forks inherit the environment of this process
+        """
+        stats_dir = self.get_option("cache_path") or get_ramdisk_path()
+        self.stats_path = os.path.join(stats_dir, f".unity.bitwarden.stats-{getpass.getuser()}-{os.getpid()}")
+        try:
+            os.close(os.open(self.stats_path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600))
+        except OSError as e:
+            self._display.warning(f"unity.bitwarden.stats: failed to create stats file: {e}")
+            self.stats_path = None
+            return
+        os.environ[stats.STATS_PATH_ENV] = self.stats_path
+
+    def v2_playbook_on_stats(self, _):
+        if self.stats_path is None:
+            return
+        try:
+            summary = stats.summarize(self.stats_path)
+        finally:
+            os.environ.pop(stats.STATS_PATH_ENV, None)
+            if os.path.exists(self.stats_path):
+                os.remove(self.stats_path)
+            self.stats_path = None
+        if self.get_option("format") == "json":
+            self._display.display(json.dumps(summary, sort_keys=True))
+        else:
+            self._display.banner("BITWARDEN STATS")
+            self._display.display(format_summary(summary))
+        if output_path := self.get_option("output_path"):
+            with open(output_path, "w") as output_fd:
+                json.dump(summary, output_fd, sort_keys=True)
@@ -0,0 +1,42 @@
+class ModuleDocFragment(object):
+    DOCUMENTATION = r"""
+      options:
+        backend:
+          description:
+            - how to talk to bitwarden on a cache miss
+            - V(cli) runs one `bw` process per call. `bw` processes cannot run in parallel, so they wait for each other
+            - V(serve) starts one `bw serve` process per controller run, shared by every fork, and sends it
+              HTTP requests over keep-alive connections. it is stopped when the controller process exits
+            - V(pool) runs one `bw` process per call like V(cli), but up to O(pool_size) of them in parallel.
+              each gets its own copy of the `bw` data directory on the ramdisk, which is copied again
+              whenever the last sync time of the original changes. `bw sync` and `bw unlock` must still be
+              run against the original
+            - "`bw serve` listens on a localhost port with no authentication, so any local user can read the
+              unlocked vault while it runs. do not use V(serve) on a controller shared with untrusted users"
+          type: str
+          choices: [cli, serve, pool]
+          default: cli
+          ini:
+            - section: bitwarden
+              key: backend
+          env:
+            - name: BITWARDEN_BACKEND
+        serve_timeout_seconds:
+          description: how long to wait for `bw serve` to start, and for each of its responses
+          type: int
+          default: 30
+          ini:
+            - section: bitwarden
+              key: serve_timeout_seconds
+          env:
+            - name: BITWARDEN_SERVE_TIMEOUT_SECONDS
+        pool_size:
+          description: how many `bw` processes can run in parallel with the V(pool) backend
+          type: int
+          default: 4
+          ini:
+            - section: bitwarden
+              key: pool_size
+          env:
+            - name: BITWARDEN_POOL_SIZE
+    """
@@ -7,7 +7,7 @@ class ModuleDocFragment(object):
         - "for macos: ~/tmpdisk/shm must be created with tmpdisk"
       options:
         cache_timeout_seconds:
-          description: cache will be truncated if its mtime is older than this
+          description: a cache entry expires once it is older than this
           type: int
           default: 3600
           ini:
@@ -15,6 +15,95 @@ class ModuleDocFragment(object):
               key: timeout_seconds
           env:
             - name: RAMDISK_CACHE_TIMEOUT_SECONDS
+        cache_invalidate_on_sync:
+          description:
+            - record each cache entry with the last sync time of the vault, read from the data.json of `bw`
+            - entries are dropped once `bw sync` changes the last sync time, and O(cache_timeout_seconds) and
+              O(cache_stale_seconds) are ignored, so the cache can be kept for as long as the vault is not synced
+          type: bool
+          default: false
+          ini:
+            - section: ramdisk_cache
+              key: invalidate_on_sync
+          env:
+            - name: RAMDISK_CACHE_INVALIDATE_ON_SYNC
+        cache_stale_seconds:
+          description:
+            - for this long after a cache entry expires, it is still returned while one fork refreshes it
+            - set to 0 to always wait for a fresh value
+          type: int
+          default: 0
+          ini:
+            - section: ramdisk_cache
+              key: stale_seconds
+          env:
+            - name: RAMDISK_CACHE_STALE_SECONDS
+        cache_memory_entries:
+          description:
+            - how many fresh cache entries each process keeps in memory, least recently used first out
+            - repeated lookups in the same process (in a loop, for example) are then answered without touching the ramdisk
+            - set to 0 to disable
+          type: int
+          default: 256
+          ini:
+            - section: ramdisk_cache
+              key: memory_entries
+          env:
+            - name: RAMDISK_CACHE_MEMORY_ENTRIES
+        cache_max_bytes:
+          description:
+            - once the entries in a cache directory are larger than this, least recently used entries are removed
+              until they are down to 90% of it
+            - attachments are stored in a separate directory, which has the same limit
+            - set to 0 for no limit
+          type: int
+          default: 67108864
+          ini:
+            - section: ramdisk_cache
+              key: max_bytes
+          env:
+            - name: RAMDISK_CACHE_MAX_BYTES
+        cache_max_entries:
+          description:
+            - once a cache directory has more entries than this, least recently used entries are removed
+              until it is down to 90% of it
+            - attachments are stored in a separate directory, which has the same limit
+            - set to 0 for no limit
+          type: int
+          default: 10000
+          ini:
+            - section: ramdisk_cache
+              key: max_entries
+          env:
+            - name: RAMDISK_CACHE_MAX_ENTRIES
+        cache_persistent_path:
+          description:
+            - directory on persistent disk for a second cache tier behind the ramdisk, which survives a reboot
+            - a miss on the ramdisk looks here before running `bw`, and a value found here is copied back to the ramdisk
+            - everything is encrypted with a key derived from E(BW_SESSION), so entries cannot be read without
+              the session, and they are useless once `bw lock` ends the session. without E(BW_SESSION), this is disabled
+            - files which have not been used for O(cache_timeout_seconds) are removed, which includes the files of
+              ended sessions. with O(cache_invalidate_on_sync), O(cache_persistent_max_age_seconds) is used instead
+            - requires the python library C(cryptography)
+            - unset by default, which disables the persistent tier
+          type: str
+          ini:
+            - section: ramdisk_cache
+              key: persistent_path
+          env:
+            - name: RAMDISK_CACHE_PERSISTENT_PATH
+        cache_persistent_max_age_seconds:
+          description:
+            - with O(cache_invalidate_on_sync), files in O(cache_persistent_path) which have not been read or written
+              for this long are removed, whatever the last sync time
+            - this removes the files of ended sessions, which are never read again
+          type: int
+          default: 604800
+          ini:
+            - section: ramdisk_cache
+              key: persistent_max_age_seconds
+          env:
+            - name: RAMDISK_CACHE_PERSISTENT_MAX_AGE_SECONDS
         enable_cache:
           description: enable ramdisk cache
           type: bool
@@ -11,7 +11,11 @@ DOCUMENTATION = """
   version_added: 2.17.3
   description:
     - gets an attachment from bitwarden, copies it to ramdisk cache
-    - then returns the content of that file in base64
+    - or, with O(attachment_glob), gets every matching attachment of the item at once, and returns a dictionary
+      which maps each filename to its content in base64. the item is looked up once, and the attachments are
+      downloaded concurrently
+    - attachments are stored once per unique content, named by sha256, and the cache only holds the digest
+    - then returns the content of that file in base64, optionally compressed first with O(content_encoding)
     - the `bw` command is slow and cannot be used in parallel, but this plugin uses ramdisk cache
     - so it is fast and safe in parallel.
   options:
@@ -20,9 +24,32 @@ DOCUMENTATION = """
       type: str
       required: true
     attachment_filename:
-      description: filename of the desired attachment
+      description:
+        - filename of the desired attachment
+        - exactly one of O(attachment_filename) or O(attachment_glob) is required
       type: str
-      required: true
+    attachment_glob:
+      description:
+        - shell style pattern, for example C(*.pem). every attachment of the item with a matching filename is returned
+        - use C(*) for all attachments
+        - exactly one of O(attachment_filename) or O(attachment_glob) is required
+      type: str
+    content_encoding:
+      description:
+        - V(gzip+base64) or V(zstd+base64) to compress the content before it is base64 encoded, which makes it
+          smaller to send to the host. give the same O(unity.bitwarden.write_base64_to_file#module:content_encoding)
+          to the module
+        - each attachment is compressed once, and the compressed blob is cached like the attachment itself
+        - V(zstd+base64) requires python 3.14 or the python library C(zstandard)
+      type: str
+      choices: [base64, gzip+base64, zstd+base64]
+      default: base64
+    max_workers:
+      description:
+        - with O(attachment_glob), how many attachments are downloaded at the same time
+        - with the V(cli) backend, `bw` processes still wait for each other, use the V(pool) or V(serve) backend
+      type: int
+      default: 4
   notes: []
   seealso:
     - plugin: community.general.bitwarden
@@ -31,69 +58,211 @@ DOCUMENTATION = """
       plugin_type: lookup
   extends_documentation_fragment:
     - unity.bitwarden.ramdisk_cached_lookup
+    - unity.bitwarden.bitwarden_backend
 """
 
 import os
-import base64
-import tempfile
-import subprocess
+import fnmatch
+import hashlib
+import getpass
 
+from concurrent.futures import ThreadPoolExecutor
 
 from ansible.plugins.lookup import LookupBase
-from ansible.plugins.loader import lookup_loader
 from ansible.errors import AnsibleError
+from ansible.utils.display import Display
 
 from ansible_collections.unity.bitwarden.plugins.plugin_utils.ramdisk_cached_lookup import (
     RamDiskCachedLookupBase,
-    get_ramdisk_path,
+    get_lookup_plugin,
+)
+from ansible_collections.unity.bitwarden.plugins.plugin_utils.ramdisk_store import (
+    BlobStore,
+    remove_legacy_cache,
+    remove_old_temp_files,
+)
+from ansible_collections.unity.bitwarden.plugins.plugin_utils.bitwarden_cli import (
+    get_bitwarden,
+)
+from ansible_collections.unity.bitwarden.plugins.module_utils.content_encoding import (
+    compress,
+    is_supported,
 )
 
-UNAME2TMPDIR = {
-    "linux": "/dev/shm",
-    "darwin": "~/.tmpdisk/shm",  # https://github.com/imothee/tmpdisk
-}
+display = Display()
+username = getpass.getuser()
 
 
 class LookupModule(RamDiskCachedLookupBase):
-    def get_attachment_base64(self, bw_item_id, bw_attachment_filename) -> str:
-        tmpdir = self.get_cache_dir_path()
-        fd, tempfile_path = tempfile.mkstemp(dir=tmpdir, prefix="snap.bw.")
-        os.close(fd)
-        os.chmod(tempfile_path, 0o600)
-        subprocess.run(
-            [
-                "bw",
-                "get",
-                "attachment",
-                bw_attachment_filename,
-                "--itemid",
-                bw_item_id,
-                "--output",
-                tempfile_path,
-            ],
-            stdout=subprocess.PIPE,
-            stderr=subprocess.PIPE,
-            check=True,
-        )
-        with open(tempfile_path, "rb") as fd:
-            output = base64.b64encode(fd.read()).decode("utf8")
-        os.remove(tempfile_path)
-        return output
+    def get_blob_store(self) -> BlobStore:
+        try:
+            return BlobStore(
+                os.path.join(self.get_cache_dir_path(), f".unity.bitwarden.blobs-{username}"),
+                self.get_option("cache_max_bytes"),
+                self.get_option("cache_max_entries"),
+            )
+        except OSError as e:
+            raise AnsibleError(e) from e
+
+    def download_attachment_blob(self, bw_item_id, bw_attachment_filename) -> dict:
+        """
+        download an attachment into the blob store, returns its digest and size
+        """
+        blob_store = self.get_blob_store()
+        tempfile_path = blob_store.mkstemp()
+        try:
+            bitwarden = get_bitwarden(
+                self.get_option("backend"),
+                self.get_cache_dir_path(),
+                self.get_option("serve_timeout_seconds"),
+                self.get_option("pool_size"),
+            )
+            bitwarden.download_attachment(bw_item_id, bw_attachment_filename, tempfile_path)
+            digest, size = self.add_blob(blob_store, tempfile_path)
+        finally:
+            if os.path.exists(tempfile_path):
+                os.remove(tempfile_path)
+        # left behind by older versions of this plugin, which downloaded straight into the cache directory
+        try:
+            remove_old_temp_files(self.get_cache_dir_path())
+        except OSError as e:
+            display.v(f"failed to remove old temporary files: {e}")
+        # attachments were cached here, with their content inline, before the blob store
+        try:
+            remove_legacy_cache(os.path.join(self.get_cache_dir_path(), ".unity.bitwarden.cache"))
+        except OSError as e:
+            display.v(f"failed to remove the old attachment cache: {e}")
+        return {"sha256": digest, "size": size}
+
+    def compress_blob(self, digest: str, content_encoding: str) -> dict:
+        """
+        compress a blob into a new blob, returns its digest and size
+        raises FileNotFoundError if there is no such blob
+        """
+        blob_store = self.get_blob_store()
+        with open(blob_store.blob_path(digest), "rb") as src_fd:
+            tempfile_path = blob_store.mkstemp()
+            try:
+                with open(tempfile_path, "wb") as dst_fd:
+                    compress(src_fd, dst_fd, content_encoding)
+                digest, size = self.add_blob(blob_store, tempfile_path)
+            finally:
+                if os.path.exists(tempfile_path):
+                    os.remove(tempfile_path)
+        return {"sha256": digest, "size": size}
+
+    def add_blob(self, blob_store: BlobStore, tempfile_path: str) -> tuple:
+        """
+        add a file from mkstemp to the blob store, and to the persistent cache if there is one
+        the persistent copy is read from the temporary file, which eviction by another fork cannot remove
+        """
+        if (persistent_store := self.get_persistent_store()) is not None:
+            with open(tempfile_path, "rb") as tempfile_fd:
+                content = tempfile_fd.read()
+            persistent_store.set_blob(hashlib.sha256(content).hexdigest(), content)
+        return blob_store.add_file(tempfile_path)
+
+    def restore_blob(self, digest: str) -> bool:
+        """
+        copy a blob from the persistent cache back into the blob store, if it is there
+        """
+        if (persistent_store := self.get_persistent_store()) is None:
+            return False
+        if (content := persistent_store.get_blob(digest)) is None:
+            return False
+        blob_store = self.get_blob_store()
+        tempfile_path = blob_store.mkstemp()
+        try:
+            with open(tempfile_path, "wb") as tempfile_fd:
+                tempfile_fd.write(content)
+            blob_store.add_file(tempfile_path)
+        finally:
+            if os.path.exists(tempfile_path):
+                os.remove(tempfile_path)
+        return True
 
     def run(self, terms, variables=None, **kwargs):
         self.set_options(direct=kwargs)
-        bw_item_name = self.get_option("item_name")
-        bw_attachment_filename = self.get_option("attachment_filename")
+        self.check_options()
+        # ansible requires that lookup returns a list
+        return [self.get_base64(self.get_item(variables))]
 
-        bw_item_id = lookup_loader.get("unity.bitwarden.bitwarden").run(
-            [bw_item_name], variables, field="id"
+    def check_options(self):
+        if (self.get_option("attachment_filename") is None) == (self.get_option("attachment_glob") is None):
+            raise AnsibleError("exactly one of attachment_filename or attachment_glob is required")
+        if not is_supported(self.get_option("content_encoding")):
+            raise AnsibleError("content_encoding zstd+base64 requires python 3.14 or the python library zstandard")
+
+    def get_item(self, variables) -> dict:
+        return get_lookup_plugin("unity.bitwarden.bitwarden").run(
+            [self.get_option("item_name")], variables, backend=self.get_option("backend")
         )[0]
 
-        output = self.cache_lambda(
-            f"{bw_item_id}.{bw_attachment_filename}",
-            ".unity.bitwarden.cache",
-            lambda: self.get_attachment_base64(bw_item_id, bw_attachment_filename),
+    def get_base64(self, bw_item: dict):
+        """
+        returns the base64 of the attachment, or with attachment_glob a dictionary {filename: base64}
+        """
+        if (bw_attachment_glob := self.get_option("attachment_glob")) is not None:
+            return self.get_matching_attachments_base64(bw_item, bw_attachment_glob)
+        return self.get_attachment_base64(bw_item["id"], self.get_option("attachment_filename"))
+
+    def get_matching_attachments_base64(self, bw_item: dict, bw_attachment_glob: str) -> dict:
+        """
+        the attachment list comes from the item, which is looked up once
+        then the attachments are fetched concurrently, each one cached by itself like in single attachment mode
+        returns {filename: base64}
+        """
+        filenames = [
+            attachment["fileName"]
+            for attachment in bw_item.get("attachments") or []
+            if fnmatch.fnmatchcase(attachment["fileName"], bw_attachment_glob)
+        ]
+        if duplicates := {x for x in filenames if filenames.count(x) > 1}:
+            raise AnsibleError(f'item "{bw_item["name"]}" has multiple attachments named: {sorted(duplicates)}')
+        display.v(f"attachments of item {bw_item['name']} matching {bw_attachment_glob}: {filenames}")
+        if not filenames:
+            return {}
+        max_workers = min(self.get_option("max_workers"), len(filenames))
+        with ThreadPoolExecutor(max_workers=max(max_workers, 1)) as executor:
+            outputs = executor.map(lambda x: self.get_attachment_base64(bw_item["id"], x), filenames)
+            return dict(zip(filenames, outputs))
+
+    def read_blob(self, cache_key, fetch_func, read_func):
+        """
+        the cache only holds the digest and size of a blob, the content is in the blob store
+        returns read_func(digest). read_func raises FileNotFoundError if the blob has been evicted, even by another
+        fork after the digest was found, and then the blob is restored from the persistent cache or fetched again
+        """
+        cache_basename = f".unity.bitwarden.cache-{username}"
+        blob = self.cache_lambda(cache_key, cache_basename, fetch_func)
+        try:
+            return read_func(blob["sha256"])
+        except FileNotFoundError:
+            pass
+        if self.restore_blob(blob["sha256"]):
+            display.v(f"({cache_key}) blob {blob['sha256']} restored from the persistent cache")
+        else:
+            display.v(f"({cache_key}) blob {blob['sha256']} is missing, fetching again")
+            self.cache_delete(cache_key, cache_basename)
+            blob = self.cache_lambda(cache_key, cache_basename, fetch_func)
+        return read_func(blob["sha256"])
+
+    def read_attachment_blob(self, bw_item_id, bw_attachment_filename, read_func):
+        return self.read_blob(
+            f"blob.{bw_item_id}.{bw_attachment_filename}",
+            lambda: self.download_attachment_blob(bw_item_id, bw_attachment_filename),
+            read_func,
         )
 
-        # ansible requires that lookup returns a list
-        return [output]
+    def get_attachment_base64(self, bw_item_id, bw_attachment_filename) -> str:
+        read_base64 = self.get_blob_store().read_base64
+        content_encoding = self.get_option("content_encoding")
+        if content_encoding == "base64":
+            return self.read_attachment_blob(bw_item_id, bw_attachment_filename, read_base64)
+        return self.read_blob(
+            f"blob.{content_encoding}.{bw_item_id}.{bw_attachment_filename}",
+            lambda: self.read_attachment_blob(
+                bw_item_id, bw_attachment_filename, lambda digest: self.compress_blob(digest, content_encoding)
+            ),
+            read_base64,
+        )
@@ -29,25 +29,44 @@ DOCUMENTATION = """
           - name: BITWARDEN_DEFAULT_COLLECTION_ID
         required: false
         type: string
+    snapshot:
+      description:
+        - list every item in the collection with a single `bw list items` and cache the result as an index
+        - lookups are then answered from that index instead of running `bw` once per term
+        - only the O(field), O(search) and O(collection_id) options are supported in this mode,
+          lookups using other options fall back to P(community.general.bitwarden#lookup) with the V(cli) backend
+      type: bool
+      default: false
+      ini:
+        - section: bitwarden
+          key: snapshot
+      env:
+        - name: BITWARDEN_SNAPSHOT
   notes: []
   seealso:
     - plugin: community.general.bitwarden
       plugin_type: lookup
   extends_documentation_fragment:
     - unity.bitwarden.ramdisk_cached_lookup
+    - unity.bitwarden.bitwarden_backend
 """
 
-import hashlib
+import json
 import getpass
 
 from ansible.plugins.lookup import LookupBase
-from ansible.plugins.loader import lookup_loader
 from ansible.errors import AnsibleError
 from ansible.utils.display import Display
 
 from ansible_collections.unity.bitwarden.plugins.plugin_utils.ramdisk_cached_lookup import (
     RamDiskCachedLookupBase,
+    get_lookup_plugin,
 )
+from ansible_collections.unity.bitwarden.plugins.plugin_utils.bitwarden_cli import (
+    bw_lock,
+    get_bitwarden,
+)
+from ansible_collections.unity.bitwarden.plugins.plugin_utils import stats
 
 display = Display()
 username = getpass.getuser()
@@ -73,15 +92,87 @@ def make_shell_command(terms, **kwargs) -> str:
     return "; ".join(subcommands)
 
 
+# options of community.general.bitwarden that this plugin can handle by itself.
+# for these, the matching items are cached and the field is picked out of the cached items
+NATIVE_OPTIONS = {"field", "search", "collection_id"}
+# item keys indexed in every snapshot
+SNAPSHOT_INDEX_FIELDS = ["id", "name"]
+
+
+def make_snapshot(bitwarden, collection_id=None) -> dict:
+    """
+    list every item in the collection with one `bw` command and index them by SNAPSHOT_INDEX_FIELDS
+    the index maps each field value to a list of positions in the item list
+    """
+    display.v(f"taking bitwarden snapshot of collection {collection_id}")
+    items = bitwarden.list_items(collection_id=collection_id)
+    index = {field: {} for field in SNAPSHOT_INDEX_FIELDS}
+    for i, item in enumerate(items):
+        for field in SNAPSHOT_INDEX_FIELDS:
+            if (value := item.get(field)) is not None:
+                index[field].setdefault(value, []).append(i)
+    return {"items": items, "index": index}
+
+
+def search_snapshot(snapshot: dict, term: str, search_field: str) -> list:
+    if search_field in snapshot["index"]:
+        return [snapshot["items"][i] for i in snapshot["index"][search_field].get(term, [])]
+    return [item for item in snapshot["items"] if item.get(search_field) == term]
+
+
+def get_item_field(item: dict, field: str):
+    """
+    same precedence as community.general.bitwarden: custom fields, then login, then the item itself
+    raises KeyError if not found
+    """
+    for custom_field in item.get("fields") or []:
+        if custom_field["name"] == field:
+            return custom_field["value"]
+    if field in (item.get("login") or {}):
+        return item["login"][field]
+    return item[field]
+
+
+def project_field(matches: list, term: str, field=None) -> list:
+    if field is None:
+        return matches
+    results = []
+    for match in matches:
+        try:
+            results.append(get_item_field(match, field))
+        except KeyError:
+            pass
+    if matches and not results:
+        raise AnsibleError(f"field {field} does not exist in {term}")
+    return results
+
+
+def find_items(bitwarden, term: str, search_field: str, collection_id=None) -> list:
+    """
+    same matching as community.general.bitwarden, but using any backend
+    """
+    display.v(f"finding bitwarden items where {search_field} is {term} in collection {collection_id}")
+    if search_field == "id":
+        item = bitwarden.get_item(term)
+        return [] if item is None else [item]
+    matches = bitwarden.list_items(search=term, collection_id=collection_id)
+    return [item for item in matches if item.get(search_field) == term]
+
+
 def do_bitwarden_lookup(terms, variables, **kwargs):
     display.v(f"running bitwarden lookup with terms: {terms} and kwargs: {kwargs}")
-    results = lookup_loader.get("community.general.bitwarden").run(terms, variables, **kwargs)
+    with bw_lock(), stats.timed("bw", backend="community.general", command="lookup"):
+        results = get_lookup_plugin("community.general.bitwarden").run(terms, variables, **kwargs)
     # results is a nested list
     # the first index represents each term in terms
     # the second index represents each item that matches that term
     flat_results = []
     for result_list in results:
         flat_results += result_list
+    return check_single_result(flat_results, terms, **kwargs)
+
+
+def check_single_result(flat_results: list, terms, **kwargs) -> list:
     if len(flat_results) == 0:
         raise AnsibleError(
             "\n".join(
@@ -118,14 +209,86 @@ class LookupModule(RamDiskCachedLookupBase):
         self.set_options(direct=kwargs)
         if len(terms) != 1:
             raise AnsibleError(f"exactly one posisional argument required. Given: {terms}")
+        kwargs = self.get_lookup_kwargs(kwargs)
+        native = True
+        if unsupported := set(kwargs) - NATIVE_OPTIONS:
+            display.v(f"options not supported natively: {unsupported}. using community.general.bitwarden.")
+            native = False
+        if not native:
+            return self.cache_lambda(
+                self.get_cache_key(terms, kwargs),
+                f".unity.bitwarden.cache-{username}",
+                lambda: do_bitwarden_lookup(terms, variables, **kwargs),
+            )
+
+        term = terms[0]
+        search_field = kwargs.get("search", "name")
+        collection_id = kwargs.get("collection_id")
+        if self.get_option("snapshot"):
+            matches = search_snapshot(self.get_snapshot(collection_id), term, search_field)
+        else:
+            # no results and multiple results are cached too, so that they are not looked up again
+            matches = self.cache_lambda(
+                self.get_items_cache_key(term, search_field, collection_id),
+                f".unity.bitwarden.cache-{username}",
+                lambda: find_items(self.get_bitwarden(), term, search_field, collection_id),
+            )
+        return check_single_result(project_field(matches, term, kwargs.get("field")), terms, **kwargs)
 
+    def prefetch(self, terms, variables=None, **kwargs):
+        """
+        fill the cache entry which `run` would read for these arguments, using a snapshot
+        many lookups can be prefetched from one snapshot, so `bw` is only run once per collection
+        the entry holds the matching items, so it serves every field of those items
+        """
+        self.set_options(direct=kwargs)
+        kwargs = self.get_lookup_kwargs(kwargs)
+        if unsupported := set(kwargs) - NATIVE_OPTIONS:
+            raise AnsibleError(f"options not supported by prefetch: {unsupported}")
+        term = terms[0]
+        search_field = kwargs.get("search", "name")
+        collection_id = kwargs.get("collection_id")
+        snapshot = self.get_snapshot(collection_id)
+        if self.get_option("snapshot"):
+            # `run` reads the snapshot directly
+            return
+        self.cache_lambda(
+            self.get_items_cache_key(term, search_field, collection_id),
+            f".unity.bitwarden.cache-{username}",
+            lambda: search_snapshot(snapshot, term, search_field),
+        )
+
+    def get_lookup_kwargs(self, kwargs: dict) -> dict:
+        """
+        the options which are passed to community.general.bitwarden, which excludes the options of this plugin
+        """
+        kwargs = {k: v for k, v in kwargs.items() if not self.has_option(k)}
         default_collection_id = self.get_option("default_collection_id")
         if "collection_id" not in kwargs and default_collection_id is not None:
             kwargs["collection_id"] = default_collection_id
+        return kwargs
+
+    @staticmethod
+    def get_cache_key(terms, kwargs: dict) -> str:
+        # the store verifies the full key, so it must be canonical but it need not be short
+        return json.dumps({"terms": terms, "kwargs": kwargs}, sort_keys=True, default=str)
+
+    @staticmethod
+    def get_items_cache_key(term: str, search_field: str, collection_id=None) -> str:
+        key = {"term": term, "search": search_field, "collection_id": collection_id}
+        return "items." + json.dumps(key, sort_keys=True, default=str)
+
+    def get_bitwarden(self):
+        return get_bitwarden(
+            self.get_option("backend"),
+            self.get_cache_dir_path(),
+            self.get_option("serve_timeout_seconds"),
+            self.get_option("pool_size"),
+        )
 
-        cache_key = hashlib.sha1((str(terms) + str(kwargs)).encode()).hexdigest()[:5]
+    def get_snapshot(self, collection_id=None) -> dict:
         return self.cache_lambda(
-            cache_key,
+            f"snapshot.{collection_id}",
             f".unity.bitwarden.cache-{username}",
-            lambda: do_bitwarden_lookup(terms, variables, **kwargs),
+            lambda: make_snapshot(self.get_bitwarden(), collection_id),
         )
@@ -0,0 +1,109 @@
+DOCUMENTATION = """
+  name: prefetch
+  author: Simon Leary <simon.leary42@proton.me>
+  requirements:
+    - bw (command line utility)
+    - be logged into bitwarden
+    - bitwarden vault unlocked
+    - E(BW_SESSION) environment variable set
+  short_description: fill the cache for many bitwarden lookups at once
+  version_added: 2.17.3
+  description:
+    - fills the cache read by P(unity.bitwarden.bitwarden#lookup) and P(unity.bitwarden.attachment_base64#lookup)
+    - items are found with one `bw list items` per collection, then attachments are downloaded concurrently
+    - use it once in C(pre_tasks), so that later lookups in every fork are cache hits
+    - each item is cached with all of its fields, so O(unity.bitwarden.bitwarden#lookup:field) does not matter here
+    - the same C(search) and C(collection_id) must be used here and in the later lookups,
+      or they will not find the cache entries
+    - C(search) and C(collection_id) only apply to O(_terms). like P(unity.bitwarden.attachment_base64#lookup),
+      the items of O(attachments) are found by name in the default collection
+  options:
+    _terms:
+      description:
+        - items to prefetch. each is either an item name, or a dictionary of P(unity.bitwarden.bitwarden#lookup)
+          options with the item name under the key C(name)
+        - only the options O(unity.bitwarden.bitwarden#lookup:field), C(search) and C(collection_id) are supported
+      type: list
+      elements: raw
+      default: []
+    attachments:
+      description:
+        - attachments to prefetch. each is a list C([item_name, attachment_filename])
+          or a dictionary of P(unity.bitwarden.attachment_base64#lookup) options
+      type: list
+      elements: raw
+      default: []
+    max_workers:
+      description:
+        - how many attachments are downloaded at the same time
+        - with the V(cli) backend, `bw` processes still wait for each other, use the V(pool) or V(serve) backend
+      type: int
+      default: 4
+  notes: []
+  seealso:
+    - plugin: unity.bitwarden.bitwarden
+      plugin_type: lookup
+    - plugin: unity.bitwarden.attachment_base64
+      plugin_type: lookup
+  extends_documentation_fragment:
+    - unity.bitwarden.ramdisk_cached_lookup
+    - unity.bitwarden.bitwarden_backend
+"""
+
+from concurrent.futures import ThreadPoolExecutor
+
+from ansible.errors import AnsibleError
+from ansible.plugins.loader import lookup_loader
+from ansible.plugins.lookup import LookupBase
+
+from ansible_collections.unity.bitwarden.plugins.plugin_utils.ramdisk_cached_lookup import get_lookup_plugin
+
+
+class LookupModule(LookupBase):
+
+    def run(self, terms, variables=None, **kwargs):
+        self.set_options(var_options=variables, direct=kwargs)
+        # options which apply to the lookups being prefetched
+        lookup_kwargs = {k: v for k, v in kwargs.items() if k not in ("attachments", "max_workers")}
+        # attachment_base64 finds its item by name in the default collection, whatever these options are
+        attachment_kwargs = {k: v for k, v in lookup_kwargs.items() if k not in ("search", "collection_id")}
+        bitwarden_lookup = get_lookup_plugin("unity.bitwarden.bitwarden")
+
+        for term in terms:
+            if isinstance(term, str):
+                term = {"name": term}
+            elif not isinstance(term, dict) or "name" not in term:
+                raise AnsibleError(f'item must be a name or a dictionary with key "name". Given: {term}')
+            item_kwargs = {k: v for k, v in term.items() if k != "name"}
+            bitwarden_lookup.prefetch([term["name"]], variables, **{**lookup_kwargs, **item_kwargs})
+
+        attachments = []
+        for attachment in self.get_option("attachments"):
+            if isinstance(attachment, (list, tuple)) and len(attachment) == 2:
+                attachment = {"item_name": attachment[0], "attachment_filename": attachment[1]}
+            elif not isinstance(attachment, dict):
+                raise AnsibleError(
+                    f"attachment must be [item_name, attachment_filename] or a dictionary. Given: {attachment}"
+                )
+            if unsupported := {"search", "collection_id"} & set(attachment):
+                raise AnsibleError(f"options not supported for attachments: {sorted(unsupported)}")
+            attachments.append(attachment)
+        for attachment in attachments:
+            bitwarden_lookup.prefetch([attachment["item_name"]], variables, **attachment_kwargs)
+
+        # the items are found here, one after another, since they are cache hits after the prefetch above
+        # each attachment gets its own plugin instance, since options are set per instance and the downloads
+        # run concurrently
+        jobs = []
+        for attachment in attachments:
+            attachment_lookup = lookup_loader.get("unity.bitwarden.attachment_base64")
+            attachment_lookup.set_options(direct={**attachment_kwargs, **attachment})
+            attachment_lookup.check_options()
+            jobs.append((attachment_lookup, attachment_lookup.get_item(variables)))
+        if jobs:
+            max_workers = min(self.get_option("max_workers"), len(jobs))
+            with ThreadPoolExecutor(max_workers=max(max_workers, 1)) as executor:
+                # list() so that an error in any download is raised here
+                list(executor.map(lambda job: job[0].get_base64(job[1]), jobs))
+
+        return [{"items": len(terms), "attachments": len(attachments)}]
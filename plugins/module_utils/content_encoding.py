@@ -0,0 +1,101 @@
+"""
+compression of content for transport, shared by the attachment_base64 lookup, the write_base64_to_file action,
+and the write_base64_to_file and write_base64_files modules
+with "gzip+base64" or "zstd+base64", the content is compressed and then base64 encoded
+gzip is in the standard library. zstd needs python 3.14 or the `zstandard` library
+"""
+
+import gzip
+import zlib
+import shutil
+
+try:
+    # python 3.14+
+    from compression import zstd as stdlib_zstd
+except ImportError:
+    stdlib_zstd = None
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+HAS_ZSTD = stdlib_zstd is not None or zstandard is not None
+
+CONTENT_ENCODINGS = ["base64", "gzip+base64", "zstd+base64"]
+CHUNK_SIZE = 65536
+ZSTD_INPUT_CHUNK_SIZE = 16384
+GZIP_LEVEL = 9
+ZSTD_LEVEL = 19
+
+
+def is_supported(content_encoding: str) -> bool:
+    return content_encoding != "zstd+base64" or HAS_ZSTD
+
+
+def compress(src_fd, dst_fd, content_encoding: str):
+    """
+    compress one file object into another, in chunks
+    the output is deterministic, so the same content always gives the same compressed blob
+    """
+    if content_encoding == "gzip+base64":
+        # no filename and no mtime in the header
+        with gzip.GzipFile(filename="", fileobj=dst_fd, mode="wb", compresslevel=GZIP_LEVEL, mtime=0) as gzip_fd:
+            shutil.copyfileobj(src_fd, gzip_fd, CHUNK_SIZE)
+    elif content_encoding == "zstd+base64":
+        if stdlib_zstd is not None:
+            with stdlib_zstd.ZstdFile(dst_fd, mode="wb", level=ZSTD_LEVEL) as zstd_fd:
+                shutil.copyfileobj(src_fd, zstd_fd, CHUNK_SIZE)
+        else:
+            zstandard.ZstdCompressor(level=ZSTD_LEVEL).copy_stream(src_fd, dst_fd, read_size=CHUNK_SIZE)
+    else:
+        raise ValueError(f"unsupported content encoding: {content_encoding}")
+
+
+def iter_decompressed(src_fd, content_encoding: str):
+    """
+    yields the decompressed content of a file object in chunks, so that it is never all in memory
+    raises ValueError if the content is not valid
+    """
+    if content_encoding == "gzip+base64":
+        reader = gzip.GzipFile(fileobj=src_fd, mode="rb")
+        errors = (gzip.BadGzipFile, EOFError, zlib.error)
+    elif content_encoding == "zstd+base64":
+        if stdlib_zstd is not None:
+            reader = stdlib_zstd.ZstdFile(src_fd, mode="rb")
+            errors = (stdlib_zstd.ZstdError, EOFError)
+        else:
+            yield from iter_zstandard_decompressed(src_fd)
+            return
+    else:
+        raise ValueError(f"unsupported content encoding: {content_encoding}")
+    with reader:
+        try:
+            while chunk := reader.read(CHUNK_SIZE):
+                yield chunk
+        except errors as e:
+            raise ValueError(f"content is not valid {content_encoding}: {e}") from e
+
+
+def iter_zstandard_decompressed(src_fd):
+    """
+    the stream reader of the `zstandard` library does not notice a truncated frame, so instead the input is fed
+    to a decompressor object in small chunks. each output chunk is at most one input chunk times the compression ratio
+    """
+    decompressor = None
+    try:
+        while data := src_fd.read(ZSTD_INPUT_CHUNK_SIZE):
+            while data:
+                if decompressor is None:
+                    decompressor = zstandard.ZstdDecompressor().decompressobj()
+                if chunk := decompressor.decompress(data):
+                    yield chunk
+                data = b""
+                if decompressor.eof:
+                    # concatenated frames
+                    data = decompressor.unused_data
+                    decompressor = None
+    except zstandard.ZstdError as e:
+        raise ValueError(f"content is not valid zstd+base64: {e}") from e
+    if decompressor is not None:
+        raise ValueError("content is not valid zstd+base64: compressed data ended before the end of the frame")
@@ -0,0 +1,254 @@
+"""
+logic shared by the write_base64_to_file and write_base64_files modules
+"""
+
+import os
+import re
+import pwd
+import grp
+import stat
+import hashlib
+import tempfile
+
+from typing import List, Optional, Tuple
+
+from ansible_collections.unity.bitwarden.plugins.module_utils.content_encoding import iter_decompressed
+
+
+def examine_file(path: str) -> dict:
+
+    def human_readable_size(st_size) -> str:
+        if st_size < 1024:
+            return f"{st_size} bytes"
+        current_size = st_size
+        for suffix in ["KiB", "MiB", "GiB", "TiB", "PiB"]:
+            current_size = current_size / 1024
+            if current_size < 1024:
+                return f"{current_size:.2f} {suffix}"
+        return f"{current_size:.2f} {suffix}"
+
+    def human_readable_file_type(st_mode) -> str:
+        func2file_type = {
+            stat.S_ISREG: "regular file",
+            stat.S_ISDIR: "directory",
+            stat.S_ISCHR: "character device",
+            stat.S_ISBLK: "block device",
+            stat.S_ISFIFO: "FIFO/pipe",
+            stat.S_ISLNK: "symlink",
+            stat.S_ISSOCK: "socket",
+        }
+        for func, file_type in func2file_type.items():
+            if func(st_mode):
+                return file_type
+        return "unknown"
+
+    def _human_readable_stat(path: str) -> dict:
+        path_stat = os.stat(path, follow_symlinks=False)
+        return {
+            "path": path,
+            "owner": pwd.getpwuid(path_stat.st_uid).pw_name,
+            "group": grp.getgrgid(path_stat.st_gid).gr_name,
+            "file_type": human_readable_file_type(path_stat.st_mode),
+            "mode": stat.filemode(path_stat.st_mode),
+            "size": human_readable_size(path_stat.st_size),
+        }
+
+    def get_symlink_destination_absolute(symlink_path: str) -> str:
+        destination_path = os.readlink(symlink_path)
+        if not os.path.isabs(destination_path):
+            # "/a/b/c" -> "../d" = "a/b/c/../d"
+            return os.path.abspath(os.path.join(os.path.dirname(symlink_path), destination_path))
+        return destination_path
+
+    def human_readable_stat(path) -> List[dict]:
+        """
+        Return a list of human-readable stat dictionaries. If the path is a symlink,
+        append another dict to the list using the destination of that symlink, and so on.
+        """
+        path = os.path.abspath(path)
+        output = [_human_readable_stat(path)]
+        seen_paths = [path]  # To handle cyclic symlinks
+        while output[-1]["file_type"] == "symlink":
+            path = get_symlink_destination_absolute(path)
+            if path in seen_paths:
+                raise RecursionError(f"Cyclic symlinks detected: {seen_paths + [path]}")
+            output.append(_human_readable_stat(path))
+        return output
+
+    output = {}
+    try:
+        output["stat"] = human_readable_stat(path)
+        output["state"] = "present"
+        if output["stat"][-1]["file_type"] == "regular file":  # follow symlinks
+            try:
+                with open(path, "r", encoding="utf8") as fp:
+                    output["content"] = fp.read()
+            except UnicodeDecodeError:
+                with open(path, "rb") as fp:
+                    output["content"] = (
+                        f"content ommitted, binary file. sha1sum: {hashlib.sha1(fp.read()).hexdigest()}"
+                    )
+        elif output["stat"][-1]["file_type"] == "directory":  # follow symlinks
+            output["content"] = os.listdir(path)
+        else:
+            output["content"] = "content ommitted, special file."
+    except FileNotFoundError:
+        output = {"state": "absent", "stat": None, "content": None}
+    return output
+
+
+def minimize_examination(examination: dict) -> dict:
+    if examination["state"] == "absent":
+        return examination
+    return {
+        "state": examination["state"],
+        "content": examination["content"],
+        "stat": [
+            {
+                "owner": examination["stat"][-1]["owner"],
+                "group": examination["stat"][-1]["group"],
+                "mode": examination["stat"][-1]["mode"],
+            }
+        ],
+    }
+
+
+def format_diffs(examination_before: dict, examination_after: dict) -> list:
+    output = []
+    # automatic content comparison diffs by ansible need it to be this way
+    if "content" in examination_before and "content" in examination_after:
+        output.append(
+            {"before": examination_before["content"], "after": examination_after["content"]}
+        )
+        del examination_before["content"]
+        del examination_after["content"]
+    output.append({"before": examination_before, "after": examination_after})
+    return output
+
+
+def file_matches(path: str, size: int, sha256_digest: bytes, uid: int, gid: int, mode: int) -> bool:
+    """
+    check if a file already has this content, owner, group and mode
+    stat is checked first, and then the content is hashed in chunks without reading it all into memory
+    """
+    try:
+        path_stat = os.stat(path)
+    except FileNotFoundError:
+        return False
+    if (
+        not stat.S_ISREG(path_stat.st_mode)
+        or path_stat.st_size != size
+        or path_stat.st_uid != uid
+        or path_stat.st_gid != gid
+        or stat.S_IMODE(path_stat.st_mode) != mode
+    ):
+        return False
+    sha256 = hashlib.sha256()
+    with open(path, "rb") as fp:
+        while chunk := fp.read(65536):
+            sha256.update(chunk)
+    return sha256.digest() == sha256_digest
+
+
+def get_validation_error(dest: str, mode) -> Optional[str]:
+    """
+    returns an error message, or None if dest and mode are valid
+    """
+    if os.path.exists(dest) and not os.path.isfile(dest):
+        return "destination already exists but is not a file!"
+    if not isinstance(mode, str):
+        return 'mode must be a string! example: "0755"'
+    if not re.fullmatch(r"0[0-7]{3}", mode):
+        return 'mode is not valid! example: "0755"'
+    return None
+
+
+def write_temp_file(module, chunks) -> Tuple[str, int, bytes]:
+    """
+    write content to a new temporary file one chunk at a time, so that it is never all in memory
+    returns (path, size, sha256 digest)
+    """
+    sha256 = hashlib.sha256()
+    size = 0
+    tmp_fd, tmp_path = tempfile.mkstemp(dir=module.tmpdir)
+    os.chmod(tmp_path, 0o600)
+    try:
+        with open(tmp_fd, "wb") as fp:
+            for chunk in chunks:
+                fp.write(chunk)
+                sha256.update(chunk)
+                size += len(chunk)
+    except BaseException:
+        os.remove(tmp_path)
+        raise
+    return tmp_path, size, sha256.digest()
+
+
+def move_temp_file(module, dest: str, tmp_path: str, owner_uid: int, group_gid: int, mode: str) -> dict:
+    """
+    atomically move a temporary file into place, or in check mode only compare it with dest
+    returns a result dictionary with "changed", and "diff" if requested
+    """
+    result = {"changed": True}
+    if module.check_mode and not module._diff:
+        os.remove(tmp_path)
+        return result
+
+    if module._diff:
+        examination_before = examine_file(dest)
+
+    os.chown(tmp_path, uid=owner_uid, gid=group_gid)
+    os.chmod(tmp_path, int(mode, 8))
+
+    if module.check_mode:
+        examination_before_min = minimize_examination(examination_before)
+        examination_tmp_min = minimize_examination(examine_file(tmp_path))
+        result["diff"] = format_diffs(examination_before_min, examination_tmp_min)
+        os.remove(tmp_path)
+    else:
+        module.atomic_move(tmp_path, dest, keep_dest_attrs=False)
+        # when dest did not exist before, atomic_move resets owner and mode to the defaults from euid and umask
+        os.chown(dest, uid=owner_uid, gid=group_gid)
+        os.chmod(dest, int(mode, 8))
+        if module._diff:
+            examination_after = examine_file(dest)
+            result["diff"] = format_diffs(examination_before, examination_after)
+    return result
+
+
+def install_temp_file(
+    module, dest: str, tmp_path: str, size: int, sha256_digest: bytes, owner_uid: int, group_gid: int, mode: str
+) -> dict:
+    """
+    move a temporary file from write_temp_file into place, unless dest already matches
+    """
+    if file_matches(dest, size, sha256_digest, owner_uid, group_gid, int(mode, 8)):
+        os.remove(tmp_path)
+        return {"changed": False}
+    return move_temp_file(module, dest, tmp_path, owner_uid, group_gid, mode)
+
+
+def write_file(module, dest: str, content_bytes: bytes, owner_uid: int, group_gid: int, mode: str) -> dict:
+    """
+    write content to a temporary file and atomically move it into place, unless dest already matches
+    returns a result dictionary with "changed", and "diff" if requested
+    """
+    content_sha256 = hashlib.sha256(content_bytes).digest()
+    if file_matches(dest, len(content_bytes), content_sha256, owner_uid, group_gid, int(mode, 8)):
+        return {"changed": False}
+    if module.check_mode and not module._diff:
+        return {"changed": True}
+    tmp_path, _, _ = write_temp_file(module, [content_bytes])
+    return move_temp_file(module, dest, tmp_path, owner_uid, group_gid, mode)
+
+
+def write_decompressed_file(
+    module, dest: str, src_fd, content_encoding: str, owner_uid: int, group_gid: int, mode: str
+) -> dict:
+    """
+    decompress a file object straight into a temporary file, and then install it like write_file
+    the dest comparison needs the digest of the decompressed content, so the temporary file is always written
+    raises ValueError if the content is not valid
+    """
+    tmp_path, size, sha256_digest = write_temp_file(module, iter_decompressed(src_fd, content_encoding))
+    return install_temp_file(module, dest, tmp_path, size, sha256_digest, owner_uid, group_gid, mode)
@@ -0,0 +1,105 @@
+#!/usr/bin/python
+
+"""
+bulk version of write_base64_to_file: writes many files in one module invocation.
+`files` is a list of dictionaries, each with the same options as write_base64_to_file: dest, content, content_encoding,
+owner, group, mode.
+every entry is validated before any file is written. users and groups are each looked up once.
+compressed entries are validated by decompressing them into temporary files, which are then moved into place.
+"""
+
+import io
+import pwd
+import grp
+import base64
+import binascii
+
+from ansible.module_utils.basic import AnsibleModule, missing_required_lib
+from ansible_collections.unity.bitwarden.plugins.module_utils.content_encoding import (
+    CONTENT_ENCODINGS,
+    is_supported,
+    iter_decompressed,
+)
+from ansible_collections.unity.bitwarden.plugins.module_utils.write_base64 import (
+    get_validation_error,
+    install_temp_file,
+    write_file,
+    write_temp_file,
+)
+
+
+def main():
+    module_args = dict(
+        files=dict(
+            type="list",
+            elements="dict",
+            required=True,
+            options=dict(
+                content=dict(type="str", required=True),
+                content_encoding=dict(type="str", default="base64", choices=CONTENT_ENCODINGS),
+                dest=dict(type="str", required=True),
+                owner=dict(type="str", required=True),
+                group=dict(type="str", required=True),
+                mode=dict(type="str", required=True),
+            ),
+        ),
+    )
+    module = AnsibleModule(argument_spec=module_args, supports_check_mode=True)
+    files = module.params["files"]
+    owner2uid = {}
+    group2gid = {}
+    # decoded content, or (tmp_path, size, sha256 digest) of decompressed content
+    decoded_list = []
+    for file in files:
+        dest = file["dest"]
+        if error := get_validation_error(dest, file["mode"]):
+            module.exit_json(failed=True, msg=f'"{dest}": {error}')
+        if file["owner"] not in owner2uid:
+            try:
+                owner2uid[file["owner"]] = pwd.getpwnam(file["owner"]).pw_uid
+            except KeyError:
+                module.exit_json(failed=True, msg=f'"{dest}": no such user: "{file["owner"]}"')
+        if file["group"] not in group2gid:
+            try:
+                group2gid[file["group"]] = grp.getgrnam(file["group"]).gr_gid
+            except KeyError:
+                module.exit_json(failed=True, msg=f'"{dest}": no such group: "{file["group"]}"')
+        if not is_supported(file["content_encoding"]):
+            module.exit_json(failed=True, msg=f'"{dest}": {missing_required_lib("zstandard")}')
+        try:
+            content_bytes = base64.b64decode(file["content"])
+        except binascii.Error:
+            module.exit_json(failed=True, msg=f'"{dest}": content is not valid base64!')
+        if file["content_encoding"] == "base64":
+            decoded_list.append(content_bytes)
+            continue
+        try:
+            decoded_list.append(
+                write_temp_file(module, iter_decompressed(io.BytesIO(content_bytes), file["content_encoding"]))
+            )
+        except ValueError as e:
+            module.exit_json(failed=True, msg=f'"{dest}": {e}')
+
+    results = []
+    diffs = []
+    for file, decoded in zip(files, decoded_list):
+        owner_uid = owner2uid[file["owner"]]
+        group_gid = group2gid[file["group"]]
+        if isinstance(decoded, bytes):
+            file_result = write_file(module, file["dest"], decoded, owner_uid, group_gid, file["mode"])
+        else:
+            tmp_path, size, sha256_digest = decoded
+            file_result = install_temp_file(
+                module, file["dest"], tmp_path, size, sha256_digest, owner_uid, group_gid, file["mode"]
+            )
+        for diff in file_result.get("diff", []):
+            diffs.append(dict(diff, before_header=file["dest"], after_header=file["dest"]))
+        results.append(dict(file_result, dest=file["dest"]))
+    result = {"changed": any(x["changed"] for x in results), "results": results}
+    if diffs:
+        result["diff"] = diffs
+    module.exit_json(**result)
+
+
+if __name__ == "__main__":
+    main()
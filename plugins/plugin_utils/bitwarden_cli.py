@@ -0,0 +1,487 @@
+import os
+import re
+import sys
+import json
+import time
+import fcntl
+import shutil
+import signal
+import socket
+import getpass
+import threading
+import subprocess
+import urllib.parse
+
+from contextlib import contextmanager, nullcontext
+
+from ansible.errors import AnsibleError
+from ansible.utils.display import Display
+
+from ansible_collections.unity.bitwarden.plugins.plugin_utils import stats
+
+display = Display()
+
+
+def get_bw_data_dir() -> str:
+    """
+    the directory where `bw` keeps its data.json, using the same logic as `bw` itself
+    """
+    if data_dir := os.environ.get("BITWARDENCLI_APPDATA_DIR"):
+        return os.path.abspath(data_dir)
+    if sys.platform == "darwin":
+        return os.path.expanduser("~/Library/Application Support/Bitwarden CLI")
+    if xdg_config_home := os.environ.get("XDG_CONFIG_HOME"):
+        return os.path.join(xdg_config_home, "Bitwarden CLI")
+    return os.path.expanduser("~/.config/Bitwarden CLI")
+
+
+@contextmanager
+def bw_lock():
+    """
+    `bw` processes sharing a data directory cannot run in parallel
+    this lock is scoped to the data directory, so it is shared by every fork and every user of that directory
+    """
+    data_dir = get_bw_data_dir()
+    lock_path = os.path.join(data_dir, ".unity.bitwarden.lock")
+    try:
+        os.makedirs(data_dir, mode=0o700, exist_ok=True)
+        lock_fd = open(os.open(lock_path, os.O_RDWR | os.O_CREAT, 0o600), "r+")
+    except OSError as e:
+        raise AnsibleError(e) from e
+    with lock_fd:
+        display.v(f"acquiring lock on file '{lock_path}'...")
+        with stats.timed("lock_wait", lock="bw"):
+            fcntl.flock(lock_fd, fcntl.LOCK_EX)
+        display.v(f"lock acquired on file '{lock_path}'.")
+        try:
+            yield
+        finally:
+            fcntl.flock(lock_fd, fcntl.LOCK_UN)
+
+
+# when every pool slot is busy, the first waiter polls the slots, backing off from the min to the max
+POOL_POLL_MIN_SECONDS = 0.01
+POOL_POLL_MAX_SECONDS = 0.1
+
+
+# matches both the old layout ("lastSync" inside the user's profile)
+# and the new one ("user_<id>_vaultSync_lastSync" at the top level)
+LAST_SYNC_REGEX = re.compile(rb'lastSync"\s*:\s*"([^"]*)"')
+
+
+# data.json path -> ((inode, size, modification time), revision)
+VAULT_REVISIONS = {}
+
+
+def get_vault_revision(data_dir=None) -> str:
+    """
+    a string which changes whenever `bw sync` changes the vault, read from data.json without running `bw`
+    falls back to the modification time of data.json if it has no last sync timestamp
+    data.json is only read again once its stat changes, so this is usually just one stat call
+    """
+    data_path = os.path.join(data_dir or get_bw_data_dir(), "data.json")
+    try:
+        stat = os.stat(data_path)
+    except FileNotFoundError:
+        return ""
+    stat_key = (stat.st_ino, stat.st_size, stat.st_mtime_ns)
+    if (cached := VAULT_REVISIONS.get(data_path)) is not None and cached[0] == stat_key:
+        return cached[1]
+    try:
+        with open(data_path, "rb") as data_fd:
+            last_syncs = LAST_SYNC_REGEX.findall(data_fd.read())
+    except FileNotFoundError:
+        return ""
+    revision = max(last_syncs).decode() if last_syncs else str(stat.st_mtime_ns)
+    VAULT_REVISIONS[data_path] = (stat_key, revision)
+    return revision
+
+
+class BitwardenNotFoundError(AnsibleError):
+    pass
+
+
+def run_bw(args: list, data_dir=None) -> bytes:
+    """
+    run `bw` with the given arguments while holding the bw lock, return stdout
+    if data_dir is given, `bw` uses that data directory instead, and the caller is responsible for locking
+    """
+    if data_dir is None:
+        lock = bw_lock()
+        env = None
+        backend = "cli"
+    else:
+        lock = nullcontext()
+        env = {**os.environ, "BITWARDENCLI_APPDATA_DIR": data_dir}
+        backend = "pool"
+    with lock:
+        display.v(f"running command: {['bw'] + args}")
+        try:
+            with stats.timed("bw", backend=backend, command=" ".join(args[:2])):
+                proc = subprocess.run(
+                    ["bw"] + args, stdout=subprocess.PIPE, stderr=subprocess.PIPE, check=True, env=env
+                )
+        except FileNotFoundError as e:
+            raise AnsibleError("`bw` command not found.") from e
+        except subprocess.CalledProcessError as e:
+            if b"Not found." in e.stderr:
+                raise BitwardenNotFoundError(f"not found: {e.cmd}") from e
+            raise AnsibleError(f"command failed: {e.cmd}\n{e.stderr.decode()}") from e
+    return proc.stdout
+
+
+class BitwardenCLI:
+    """
+    runs one `bw` process per call. calls are serialized by bw_lock
+    """
+
+    def run_bw(self, args: list) -> bytes:
+        return run_bw(args)
+
+    def list_items(self, search=None, collection_id=None, organization_id=None) -> list:
+        args = ["list", "items"]
+        if search is not None:
+            args += ["--search", search]
+        if collection_id is not None:
+            args += ["--collectionid", collection_id]
+        if organization_id is not None:
+            args += ["--organizationid", organization_id]
+        return json.loads(self.run_bw(args))
+
+    def get_item(self, item_id: str):
+        """
+        returns None if there is no such item
+        """
+        try:
+            return json.loads(self.run_bw(["get", "item", item_id]))
+        except BitwardenNotFoundError:
+            return None
+
+    def download_attachment(self, item_id: str, attachment_filename: str, output_path: str) -> None:
+        self.run_bw(
+            ["get", "attachment", attachment_filename, "--itemid", item_id, "--output", output_path]
+        )
+
+
+def try_pool_slots(pool_dir: str, order: list):
+    """
+    returns (slot number, locked file) for the first free slot in order, or (None, None) if they are all busy
+    """
+    for slot in order:
+        lock_fd = open(os.open(os.path.join(pool_dir, f"{slot}.lock"), os.O_RDWR | os.O_CREAT, 0o600), "r+")
+        try:
+            fcntl.flock(lock_fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            return slot, lock_fd
+        except BlockingIOError:
+            lock_fd.close()
+    return None, None
+
+
+@contextmanager
+def acquire_pool_slot(pool_dir: str, size: int):
+    """
+    counting semaphore shared by every fork: take any free slot out of `size`, else wait for one
+    each slot is a lock file, so a slot is released even if its holder is killed
+    when every slot is busy, waiters line up on a queue lock. the first in line polls every slot, and takes
+    whichever is released first, so a waiter is never stuck behind one slot while another is free
+    yields the slot number
+    """
+    # start at a different slot in each process so that they do not all try the same one first
+    first = os.getpid() % size
+    order = [(first + i) % size for i in range(size)]
+    slot, lock_fd = try_pool_slots(pool_dir, order)
+    if lock_fd is None:
+        display.v(f"all {size} bitwarden data directories are busy, waiting for one...")
+        queue_path = os.path.join(pool_dir, "queue.lock")
+        with stats.timed("lock_wait", lock="pool"):
+            with open(os.open(queue_path, os.O_RDWR | os.O_CREAT, 0o600), "r+") as queue_fd:
+                fcntl.flock(queue_fd, fcntl.LOCK_EX)
+                delay = POOL_POLL_MIN_SECONDS
+                while True:
+                    slot, lock_fd = try_pool_slots(pool_dir, order)
+                    if lock_fd is not None:
+                        break
+                    time.sleep(delay)
+                    delay = min(delay * 2, POOL_POLL_MAX_SECONDS)
+    with lock_fd:
+        try:
+            yield slot
+        finally:
+            fcntl.flock(lock_fd, fcntl.LOCK_UN)
+
+
+def refresh_data_dir_copy(copy_dir: str) -> None:
+    """
+    make copy_dir a copy of the `bw` data directory, unless it is already a copy of the current revision
+    the caller must hold the slot lock for copy_dir
+    """
+    source_dir = get_bw_data_dir()
+    revision = get_vault_revision(source_dir)
+    revision_path = os.path.join(copy_dir, ".unity.bitwarden.revision")
+    try:
+        with open(revision_path, "r") as revision_fd:
+            if revision_fd.read() == revision:
+                return
+    except FileNotFoundError:
+        pass
+    display.v(f"copying bitwarden data directory '{source_dir}' to '{copy_dir}' (revision {revision})")
+    os.makedirs(copy_dir, mode=0o700, exist_ok=True)
+    # a copy which was interrupted must not look up to date
+    if os.path.exists(revision_path):
+        os.remove(revision_path)
+    # `bw` writes data.json in place, so hold the bw lock for a consistent copy
+    with bw_lock():
+        revision = get_vault_revision(source_dir)
+        for entry in os.scandir(source_dir):
+            if entry.is_file() and not entry.name.startswith(".unity.bitwarden."):
+                fd = os.open(os.path.join(copy_dir, entry.name), os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600)
+                with open(entry.path, "rb") as source_fd, open(fd, "wb") as copy_fd:
+                    shutil.copyfileobj(source_fd, copy_fd)
+    fd = os.open(revision_path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600)
+    with open(fd, "w") as revision_fd:
+        revision_fd.write(revision)
+
+
+class BitwardenPool(BitwardenCLI):
+    """
+    runs one `bw` process per call, like BitwardenCLI, but up to `size` of them in parallel
+    each process gets its own copy of the `bw` data directory on the ramdisk, so they do not share data.json
+    the copies are never synced back. they are refreshed when the last sync time of the original changes
+    """
+
+    def __init__(self, state_dir: str, size: int):
+        self.pool_dir = os.path.join(state_dir, f".unity.bitwarden.appdata-{getpass.getuser()}")
+        self.size = max(size, 1)
+        try:
+            os.makedirs(self.pool_dir, mode=0o700, exist_ok=True)
+        except OSError as e:
+            raise AnsibleError(e) from e
+
+    def run_bw(self, args: list) -> bytes:
+        try:
+            with acquire_pool_slot(self.pool_dir, self.size) as slot:
+                copy_dir = os.path.join(self.pool_dir, str(slot))
+                refresh_data_dir_copy(copy_dir)
+                return run_bw(args, data_dir=copy_dir)
+        except OSError as e:
+            raise AnsibleError(e) from e
+
+
+# runs `bw serve` and stops it when the controller process exits
+# argv: controller pid, bw serve command...
+SERVE_WATCHDOG = """
+import os, sys, time, signal, subprocess
+signal.signal(signal.SIGTERM, lambda *_: sys.exit(0))
+proc = subprocess.Popen(sys.argv[2:])
+try:
+    while proc.poll() is None:
+        os.kill(int(sys.argv[1]), 0)
+        time.sleep(1)
+except (ProcessLookupError, SystemExit):
+    pass
+finally:
+    proc.terminate()
+"""
+
+
+def get_controller_pid() -> int:
+    """
+    lookups run in worker processes forked from the controller (ansible-playbook) process
+    """
+    import multiprocessing
+
+    if multiprocessing.parent_process() is not None:
+        return os.getppid()
+    return os.getpid()
+
+
+def is_process_alive(pid: int) -> bool:
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass
+    return True
+
+
+def find_free_port() -> int:
+    with socket.socket(socket.AF_INET, socket.SOCK_STREAM) as sock:
+        sock.bind(("localhost", 0))
+        return sock.getsockname()[1]
+
+
+def start_bw_serve(state_dir: str, startup_timeout_seconds: int) -> int:
+    """
+    start `bw serve` on a localhost port unless it is already running for this controller run
+    the pid and port are kept in a json file on the ramdisk, guarded by a lock file
+    returns the port
+    """
+    state_path = os.path.join(state_dir, f".unity.bitwarden.serve-{getpass.getuser()}.json")
+    controller_pid = get_controller_pid()
+    try:
+        lock_fd = open(os.open(f"{state_path}.lock", os.O_RDWR | os.O_CREAT, 0o600), "r+")
+    except OSError as e:
+        raise AnsibleError(e) from e
+    with lock_fd:
+        fcntl.flock(lock_fd, fcntl.LOCK_EX)
+        try:
+            with open(state_path, "r") as state_fd:
+                state = json.load(state_fd)
+            if state["controller_pid"] == controller_pid and is_process_alive(state["pid"]):
+                return state["port"]
+        except (OSError, ValueError, KeyError):
+            pass
+        port = find_free_port()
+        command = ["bw", "serve", "--hostname", "localhost", "--port", str(port)]
+        display.v(f"starting bitwarden server: {command}")
+        with bw_lock():
+            proc = subprocess.Popen(
+                [sys.executable, "-c", SERVE_WATCHDOG, str(controller_pid)] + command,
+                stdin=subprocess.DEVNULL,
+                stdout=subprocess.DEVNULL,
+                stderr=subprocess.DEVNULL,
+                start_new_session=True,
+            )
+            deadline = time.time() + startup_timeout_seconds
+            while True:
+                try:
+                    socket.create_connection(("localhost", port), timeout=1).close()
+                    break
+                except OSError:
+                    pass
+                if proc.poll() is not None or time.time() > deadline:
+                    # the watchdog leads its own process group, which includes `bw serve`
+                    try:
+                        os.killpg(proc.pid, signal.SIGTERM)
+                    except ProcessLookupError:
+                        pass
+                    raise AnsibleError(f"bitwarden server failed to start: {command}")
+                time.sleep(0.1)
+        state = {"controller_pid": controller_pid, "pid": proc.pid, "port": port}
+        fd = os.open(state_path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600)
+        with open(fd, "w") as state_fd:
+            json.dump(state, state_fd)
+        return port
+
+
+class HTTPConnectionPool:
+    """
+    keep-alive connections to one host, reused by every request of this process
+    http.client is imported here rather than at the top, since it is slow to import and only used by the serve backend
+    """
+
+    def __init__(self, host: str, port: int, timeout_seconds: int):
+        self.host = host
+        self.port = port
+        self.timeout_seconds = timeout_seconds
+        self.idle_connections = []
+        self.lock = threading.Lock()
+
+    def _get_connection(self):
+        import http.client
+
+        with self.lock:
+            if self.idle_connections:
+                return self.idle_connections.pop()
+        return http.client.HTTPConnection(self.host, self.port, timeout=self.timeout_seconds)
+
+    def request(self, method: str, url: str, output_fd=None) -> tuple:
+        """
+        returns (status, body). if output_fd is given, the body is written to it instead
+        a request on a keep-alive connection which the server already closed is retried once
+        a request is not retried once part of the body has been written to output_fd, since that cannot be undone
+        """
+        import http.client
+
+        for attempt in range(2):
+            conn = self._get_connection()
+            body_written = False
+            try:
+                conn.request(method, url)
+                response = conn.getresponse()
+                if output_fd is not None and response.status == 200:
+                    while chunk := response.read(65536):
+                        body_written = True
+                        output_fd.write(chunk)
+                    body = b""
+                else:
+                    body = response.read()
+            except (http.client.RemoteDisconnected, ConnectionError) as e:
+                conn.close()
+                if attempt == 1 or body_written:
+                    raise AnsibleError(f"bitwarden server request failed: {method} {url}") from e
+                continue
+            except (OSError, http.client.HTTPException) as e:
+                conn.close()
+                raise AnsibleError(f"bitwarden server request failed: {method} {url}") from e
+            with self.lock:
+                self.idle_connections.append(conn)
+            return response.status, body
+
+
+class BitwardenServe:
+    """
+    sends each call over HTTP to a `bw serve` process shared by every fork of this controller run
+    see https://bitwarden.com/help/vault-management-api/
+    """
+
+    def __init__(self, state_dir: str, timeout_seconds: int):
+        port = start_bw_serve(state_dir, timeout_seconds)
+        self.pool = HTTPConnectionPool("localhost", port, timeout_seconds)
+
+    def _get_json(self, path: str, params: dict, command: str):
+        params = {k: v for k, v in params.items() if v is not None}
+        url = path + (f"?{urllib.parse.urlencode(params)}" if params else "")
+        display.v(f"bitwarden server request: GET {url}")
+        with stats.timed("bw", backend="serve", command=command):
+            status, body = self.pool.request("GET", url)
+        try:
+            response = json.loads(body)
+        except json.JSONDecodeError as e:
+            raise AnsibleError(f"invalid response from bitwarden server: GET {url}\n{body}") from e
+        # like the CLI, `bw serve` reports a missing object only by its message, with status 400
+        if response.get("message") == "Not found.":
+            raise BitwardenNotFoundError(f"not found: {url}")
+        if status != 200 or not response.get("success"):
+            raise AnsibleError(f"bitwarden server request failed: GET {url}\n{response}")
+        return response["data"]
+
+    def list_items(self, search=None, collection_id=None, organization_id=None) -> list:
+        params = {"search": search, "collectionid": collection_id, "organizationid": organization_id}
+        return self._get_json("/list/object/items", params, "list items")["data"]
+
+    def get_item(self, item_id: str):
+        try:
+            return self._get_json(f"/object/item/{urllib.parse.quote(item_id, safe='')}", {}, "get item")
+        except BitwardenNotFoundError:
+            return None
+
+    def download_attachment(self, item_id: str, attachment_filename: str, output_path: str) -> None:
+        url = "/object/attachment/{}?{}".format(
+            urllib.parse.quote(attachment_filename, safe=""), urllib.parse.urlencode({"itemid": item_id})
+        )
+        display.v(f"bitwarden server request: GET {url}")
+        with open(output_path, "wb") as output_fd, stats.timed("bw", backend="serve", command="get attachment"):
+            status, body = self.pool.request("GET", url, output_fd=output_fd)
+        if status != 200 and b'"Not found."' in body:
+            raise BitwardenNotFoundError(f"not found: {url}")
+        if status != 200:
+            raise AnsibleError(f"bitwarden server request failed: GET {url}\n{body}")
+
+
+BACKENDS = {}
+
+
+def get_bitwarden(backend: str, state_dir: str, serve_timeout_seconds: int, pool_size: int):
+    """
+    one client per backend per process, so that `bw serve` connections are reused
+    """
+    if backend not in BACKENDS:
+        if backend == "serve":
+            BACKENDS[backend] = BitwardenServe(state_dir, serve_timeout_seconds)
+        elif backend == "pool":
+            BACKENDS[backend] = BitwardenPool(state_dir, pool_size)
+        else:
+            BACKENDS[backend] = BitwardenCLI()
+    return BACKENDS[backend]
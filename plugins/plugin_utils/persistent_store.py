@@ -0,0 +1,176 @@
+import os
+import json
+import time
+import hmac
+import hashlib
+import tempfile
+
+try:
+    from cryptography.exceptions import InvalidTag
+    from cryptography.hazmat.primitives import hashes
+    from cryptography.hazmat.primitives.kdf.hkdf import HKDF
+    from cryptography.hazmat.primitives.ciphers.aead import AESGCM
+
+    HAS_CRYPTOGRAPHY = True
+except ImportError:
+    HAS_CRYPTOGRAPHY = False
+
+SALT_SIZE = 16
+NONCE_SIZE = 12
+HKDF_INFO = b"unity.bitwarden persistent cache"
+# the modification time of a file is only updated on read once it is older than this
+ACCESS_TIME_RESOLUTION_SECONDS = 60
+
+
+def get_salt(path: str) -> bytes:
+    """
+    random salt for the directory, created by whichever process gets there first
+    the salt is written to a temporary file which is then linked into place, so it appears complete or not at all
+    """
+    salt_path = os.path.join(path, "salt")
+    try:
+        with open(salt_path, "rb") as salt_fd:
+            salt = salt_fd.read()
+        if len(salt) == SALT_SIZE:
+            return salt
+        # left behind by an older version, which could be killed between creating and writing it
+        os.remove(salt_path)
+    except FileNotFoundError:
+        pass
+    fd, tmp_path = tempfile.mkstemp(dir=path, prefix=".tmp.")
+    try:
+        with open(fd, "wb") as tmp_fd:
+            tmp_fd.write(os.urandom(SALT_SIZE))
+        # unlike os.replace, os.link fails if another process has already created the salt
+        os.link(tmp_path, salt_path)
+    except FileExistsError:
+        pass
+    finally:
+        os.remove(tmp_path)
+    return get_salt(path)
+
+
+class EncryptedDiskStore:
+    """
+    key/value store on persistent disk, one file per key, which survives a reboot unlike the ramdisk
+    everything is encrypted with AES-GCM, using a key derived from the bitwarden session key (BW_SESSION),
+    so the files are useless without the session, and they cannot be read again once `bw lock` ends it
+    file names are keyed hashes of the keys, so the keys are not revealed either
+    files which cannot be decrypted (written with a different session, or corrupt) are treated as missing and removed
+    values have the same expiry rules as ShardedCacheStore: by age, or by revision if a revision is given
+    on every write, files which have not been read or written for max_age_seconds are removed, whatever their revision.
+    this also removes the files of old sessions, since those are never read again
+    max_age_seconds defaults to timeout_seconds
+    """
+
+    def __init__(self, path: str, secret: str, timeout_seconds: int, revision=None, max_age_seconds=None):
+        self.path = path
+        self.timeout_seconds = timeout_seconds
+        self.revision = revision
+        self.max_age_seconds = timeout_seconds if max_age_seconds is None else max_age_seconds
+        os.makedirs(path, mode=0o700, exist_ok=True)
+        os.chmod(path, 0o700)
+        key_material = HKDF(
+            algorithm=hashes.SHA256(), length=64, salt=get_salt(path), info=HKDF_INFO
+        ).derive(secret.encode())
+        self.aead = AESGCM(key_material[:32])
+        self.name_key = key_material[32:]
+
+    def _file_path(self, name: str) -> str:
+        return os.path.join(self.path, hmac.new(self.name_key, name.encode(), hashlib.sha256).hexdigest())
+
+    def _read(self, name: str):
+        """
+        returns the decrypted content, or None
+        """
+        file_path = self._file_path(name)
+        try:
+            with open(file_path, "rb") as fd:
+                data = fd.read()
+                mtime = os.fstat(fd.fileno()).st_mtime
+        except FileNotFoundError:
+            return None
+        try:
+            # the file name is authenticated too, so that files cannot be swapped
+            content = self.aead.decrypt(data[:NONCE_SIZE], data[NONCE_SIZE:], os.path.basename(file_path).encode())
+        except (InvalidTag, ValueError):
+            self._remove(file_path)
+            return None
+        if time.time() - mtime > ACCESS_TIME_RESOLUTION_SECONDS:
+            # so that prune keeps the files which are still in use
+            try:
+                os.utime(file_path)
+            except FileNotFoundError:
+                pass
+        return content
+
+    def _write(self, name: str, content: bytes):
+        file_path = self._file_path(name)
+        nonce = os.urandom(NONCE_SIZE)
+        data = nonce + self.aead.encrypt(nonce, content, os.path.basename(file_path).encode())
+        fd, tmp_path = tempfile.mkstemp(dir=self.path, prefix=".tmp.")
+        try:
+            with open(fd, "wb") as tmp_fd:
+                tmp_fd.write(data)
+            os.replace(tmp_path, file_path)
+        finally:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+
+    @staticmethod
+    def _remove(file_path: str):
+        try:
+            os.remove(file_path)
+        except FileNotFoundError:
+            pass
+
+    def get(self, key: str):
+        """
+        returns (value, creation time) if there is a fresh value, else None
+        """
+        if (content := self._read(f"value.{key}")) is None:
+            return None
+        record = json.loads(content)
+        if self.revision is not None:
+            is_fresh = record["revision"] == self.revision
+        else:
+            is_fresh = record["revision"] is None and (time.time() - record["created"]) <= self.timeout_seconds
+        if not is_fresh:
+            self._remove(self._file_path(f"value.{key}"))
+            return None
+        return record["value"], record["created"]
+
+    def set(self, key: str, value):
+        record = {"value": value, "created": time.time(), "revision": self.revision}
+        self._write(f"value.{key}", json.dumps(record).encode())
+        self.prune()
+
+    def prune(self):
+        """
+        remove files which have not been read or written for max_age_seconds, whether or not they can be decrypted
+        """
+        now = time.time()
+        for entry in os.scandir(self.path):
+            if entry.name == "salt":
+                continue
+            try:
+                if (now - entry.stat().st_mtime) > self.max_age_seconds:
+                    os.remove(entry.path)
+            except FileNotFoundError:
+                pass
+
+    def delete(self, key: str):
+        self._remove(self._file_path(f"value.{key}"))
+
+    def get_blob(self, digest: str):
+        """
+        returns the content with this sha256 hex digest, or None
+        """
+        content = self._read(f"blob.{digest}")
+        if content is not None and hashlib.sha256(content).hexdigest() != digest:
+            return None
+        return content
+
+    def set_blob(self, digest: str, content: bytes):
+        self._write(f"blob.{digest}", content)
+        self.prune()
@@ -1,31 +1,49 @@
 import os
-import json
 import time
-import fcntl
-import subprocess
+import functools
+import threading
+
+from collections import OrderedDict
 
 from ansible.errors import AnsibleError
 from ansible.utils.display import Display
 from ansible.plugins.lookup import LookupBase
+from ansible.plugins.loader import lookup_loader
+
+from ansible_collections.unity.bitwarden.plugins.plugin_utils.ramdisk_store import (
+    MISS,
+    FRESH,
+    STALE,
+    PROMOTED,
+    ShardedCacheStore,
+)
+from ansible_collections.unity.bitwarden.plugins.plugin_utils.bitwarden_cli import get_vault_revision
+from ansible_collections.unity.bitwarden.plugins.plugin_utils import stats
 
 display = Display()
 
+# process local LRU tier in front of the ramdisk cache. (cache path, key) -> (value, creation time, revision)
+MEMO = OrderedDict()
+# MEMO is shared by threads, for example attachment_base64 fetching many attachments at once
+MEMO_LOCK = threading.Lock()
+# lookup plugin name -> instance, so that each plugin is only resolved by the loader once per process
+LOOKUP_PLUGINS = {}
+
 UNAME2RAMDISK_PATH = {
     "linux": "/dev/shm",
     "darwin": "~/.tmpdisk/shm",  # https://github.com/imothee/tmpdisk
 }
 
 
+@functools.lru_cache(maxsize=None)
 def get_ramdisk_path() -> str:
     """
     return the path to a directory on a ramdisk / ramfs / memory-backed filesystem
     in our case, ansible does not provide the infrastructure to share memory, so we use a file
     use RAM to avoid leaving behind artifacts on disk hardware, with automatic delete on reboot
+    the result is memoized for the life of the process, errors are not
     """
-    try:
-        uname = subprocess.check_output("uname", text=True).strip().lower()
-    except FileNotFoundError as e:
-        raise AnsibleError("unsupported operating system: `uname` command not found.") from e
+    uname = os.uname().sysname.lower()
     try:
         tmpdir = os.path.expanduser(UNAME2RAMDISK_PATH[uname])
     except KeyError as e:
@@ -42,6 +60,16 @@ def get_ramdisk_path() -> str:
     return tmpdir
 
 
+def get_lookup_plugin(name: str):
+    """
+    memoized lookup_loader.get
+    plugins are stateless between calls to run, since each call starts with set_options, so one instance can be reused
+    """
+    if name not in LOOKUP_PLUGINS:
+        LOOKUP_PLUGINS[name] = lookup_loader.get(name)
+    return LOOKUP_PLUGINS[name]
+
+
 class RamDiskCachedLookupBase(LookupBase):
 
     def get_cache_dir_path(self):
@@ -50,6 +78,60 @@ class RamDiskCachedLookupBase(LookupBase):
         else:
             return get_ramdisk_path()
 
+    def get_cache_revision(self):
+        """
+        the vault revision that new cache entries are recorded with, or None to expire entries by time
+        """
+        if self.get_option("cache_invalidate_on_sync"):
+            return get_vault_revision()
+        return None
+
+    def get_persistent_store(self, revision=None):
+        """
+        the encrypted on-disk tier behind the ramdisk, or None if it is not enabled
+        imported here so that `cryptography` is only imported on a miss, and only if it is enabled
+        """
+        if not (persistent_path := self.get_option("cache_persistent_path")):
+            return None
+        from ansible_collections.unity.bitwarden.plugins.plugin_utils.persistent_store import (
+            HAS_CRYPTOGRAPHY,
+            EncryptedDiskStore,
+        )
+
+        if not HAS_CRYPTOGRAPHY:
+            raise AnsibleError("cache_persistent_path requires the python library `cryptography`")
+        if not (session := os.environ.get("BW_SESSION")):
+            display.v("persistent cache is disabled since BW_SESSION is not set")
+            return None
+        # with invalidate on sync, entries do not expire by age, but the files of old sessions must still go
+        max_age_seconds = None
+        if self.get_option("cache_invalidate_on_sync"):
+            max_age_seconds = self.get_option("cache_persistent_max_age_seconds")
+        return EncryptedDiskStore(
+            os.path.expanduser(persistent_path),
+            session,
+            self.get_option("cache_timeout_seconds"),
+            revision,
+            max_age_seconds,
+        )
+
+    def get_fetch_functions(self, key, cache_basename: str, lambda_func, revision=None) -> tuple:
+        """
+        returns (fetch function, lower tier function) for ShardedCacheStore.get_or_fetch
+        with the persistent tier, a miss looks there before running lambda_func, and saves what lambda_func returns
+        """
+        persistent_store = self.get_persistent_store(revision)
+        if persistent_store is None:
+            return lambda_func, None
+        persistent_key = f"{cache_basename}/{key}"
+
+        def fetch():
+            value = lambda_func()
+            persistent_store.set(persistent_key, value)
+            return value
+
+        return fetch, lambda _: persistent_store.get(persistent_key)
+
     def cache_lambda(
         self,
         key,
@@ -61,48 +143,116 @@ class RamDiskCachedLookupBase(LookupBase):
         if the result is cached, don't run the function
 
         key: unique key for the cache
+        cache_basename: name of the cache directory, each key is stored in one of its shards
         lambda_func: function that returns value for key
         """
+        if not stats.is_enabled():
+            return self._cache_lambda(key, cache_basename, lambda_func, {})
+        # filled in by _cache_lambda
+        event = {"result": "error"}
+        start = time.perf_counter()
+        try:
+            return self._cache_lambda(key, cache_basename, lambda_func, event)
+        finally:
+            stats.record("cache", seconds=time.perf_counter() - start, **event)
+
+    def _cache_lambda(self, key, cache_basename: str, lambda_func, event: dict):
         if self.get_option("enable_cache") is False:
             display.v(f"({key}) cache is disabled")
+            event["result"] = "disabled"
             return lambda_func()
-        cache_timeout_seconds = self.get_option("cache_timeout_seconds")
-        cache_dir_path = self.get_cache_dir_path()
-        cache_path = os.path.join(cache_dir_path, cache_basename)
+        cache_path = os.path.join(self.get_cache_dir_path(), cache_basename)
+        timeout_seconds = self.get_option("cache_timeout_seconds")
+        # read before fetching, so that a value fetched during a sync is recorded with the old revision
+        revision = self.get_cache_revision()
+        memo_key = (cache_path, key)
+        with MEMO_LOCK:
+            if memo_key in MEMO:
+                value, created, memo_revision = MEMO[memo_key]
+                if revision is not None:
+                    is_fresh = memo_revision == revision
+                else:
+                    is_fresh = memo_revision is None and (time.time() - created) <= timeout_seconds
+                if is_fresh:
+                    MEMO.move_to_end(memo_key)
+                    display.v(f"({key}) cache hit (memory)")
+                    event["result"] = "memory_hit"
+                    return value
+                del MEMO[memo_key]
         try:
-            if not os.path.exists(cache_path):
-                open(cache_path, "w").close()
-            if (time.time() - os.path.getmtime(cache_path)) > cache_timeout_seconds:
-                display.v(f"({key}) cache timed out, truncating...")
-                open(cache_path, "w").close()
-            os.chmod(cache_path, 0o600)
-            cache_fd = open(cache_path, "r+")  # read and write but don't truncate
+            store = ShardedCacheStore(
+                cache_path,
+                timeout_seconds,
+                self.get_option("cache_stale_seconds"),
+                revision,
+                self.get_option("cache_max_bytes"),
+                self.get_option("cache_max_entries"),
+            )
+            state, value, created = store.get(key)
+            if state == FRESH:
+                display.v(f"({key}) cache hit")
+                event["result"] = "hit"
+            elif state == STALE:
+                # only one fork refreshes a stale value, the others use it as is
+                fetch, lower_tier = self.get_fetch_functions(key, cache_basename, lambda_func, revision)
+                refresh_state, refreshed_value, refreshed_created = store.get_or_fetch(
+                    key, fetch, wait=False, lower_tier=lower_tier
+                )
+                if refresh_state == MISS and refreshed_value is None:
+                    display.v(f"({key}) cache hit (stale), another fork is refreshing it")
+                    event["result"] = "stale_hit"
+                    event["bytes_read"] = store.bytes_read
+                    return value
+                display.v(f"({key}) cache hit (stale), refreshed")
+                event["result"] = "stale_refresh"
+                state, value, created = FRESH, refreshed_value, refreshed_created
+            else:
+                display.v(f"({key}) cache miss, waiting for any other fork fetching the same key...")
+                fetch, lower_tier = self.get_fetch_functions(key, cache_basename, lambda_func, revision)
+                state, value, created = store.get_or_fetch(key, fetch, lower_tier=lower_tier)
+                if state == FRESH:
+                    display.v(f"({key}) cache hit after waiting")
+                    event["result"] = "hit_after_wait"
+                elif state == PROMOTED:
+                    display.v(f"({key}) cache hit (persistent)")
+                    event["result"] = "persistent_hit"
+                else:
+                    event["result"] = "miss"
+            event["bytes_read"] = store.bytes_read
+            event["bytes_written"] = store.bytes_written
+            if event["result"] in ["stale_refresh", "miss"] and stats.is_enabled():
+                event["cache_bytes"] = store.size_bytes()
         except OSError as e:
             raise AnsibleError(e) from e
-        display.v(f"({key}) acquiring lock on file '{cache_path}'...'")
-        fcntl.flock(cache_fd, fcntl.LOCK_EX)
-        display.v(f"({key}) lock acquired on file '{cache_path}'.'")
+        self.memoize(memo_key, value, created, revision)
+        return value
+
+    def memoize(self, memo_key: tuple, value, created: float, revision=None):
+        """
+        keep a fresh value in process memory, with the creation time and revision of its ramdisk record
+        so that it expires at the same time as the ramdisk record
+        """
+        max_entries = self.get_option("cache_memory_entries")
+        if max_entries <= 0:
+            return
+        with MEMO_LOCK:
+            MEMO[memo_key] = (value, created, revision)
+            MEMO.move_to_end(memo_key)
+            while len(MEMO) > max_entries:
+                MEMO.popitem(last=False)
+
+    def cache_delete(self, key, cache_basename: str):
+        """
+        remove a key from the ramdisk cache, the process memory cache and the persistent cache
+        """
+        cache_path = os.path.join(self.get_cache_dir_path(), cache_basename)
+        with MEMO_LOCK:
+            MEMO.pop((cache_path, key), None)
+        if self.get_option("enable_cache") is False:
+            return
         try:
-            try:
-                cache_fd.seek(0)
-                cache_contents = cache_fd.read()
-                cache = json.loads(cache_contents)
-            except json.JSONDecodeError as e:
-                display.v(f"({key}) failed to parse cache. contents may be overwritten.\n{e}")
-                display.v(cache_contents)
-                cache = {}
-            if key in cache:
-                display.v(f"({key}) cache hit")
-                return cache[key]
-            display.v(f"({key}) cache miss")
-            result = lambda_func()
-            cache[key] = result
-            cache_fd.seek(0)
-            cache_fd.truncate()
-            json.dump(cache, cache_fd)
-            cache_fd.flush()
-        finally:
-            display.v(f"({key}) releasing lock on file '{cache_path}'... ")
-            fcntl.flock(cache_fd, fcntl.LOCK_UN)
-            cache_fd.close()
-        return result
+            ShardedCacheStore(cache_path, self.get_option("cache_timeout_seconds")).delete(key)
+            if (persistent_store := self.get_persistent_store()) is not None:
+                persistent_store.delete(f"{cache_basename}/{key}")
+        except OSError as e:
+            raise AnsibleError(e) from e
@@ -0,0 +1,623 @@
+import os
+import json
+import mmap
+import time
+import fcntl
+import base64
+import shutil
+import struct
+import hashlib
+import tempfile
+
+from ansible_collections.unity.bitwarden.plugins.plugin_utils import stats
+
+SHARD_COUNT = 256
+# multiple of 3, so that base64 encoded chunks can be concatenated
+BLOB_CHUNK_SIZE = 3 * 65536
+# the access time of a record or blob is only updated once it is older than this, to avoid a write on every hit
+ACCESS_TIME_RESOLUTION_SECONDS = 60
+# temporary files older than this are left behind by a failed download, and are removed
+TEMP_MAX_AGE_SECONDS = 3600
+
+# states returned by ShardedCacheStore.get
+MISS = 0
+FRESH = 1
+STALE = 2
+# returned by ShardedCacheStore.get_or_fetch, when the value was found in the lower tier
+PROMOTED = 3
+
+# shard file layout:
+# header, then a hash index of fixed size slots, then records appended one after another
+# the index is an open addressing hash table with linear probing
+MAGIC = b"UBWC"
+VERSION = 3
+HEADER = struct.Struct("<4sIIIQ")  # magic, version, slot count, used slot count, dead record bytes
+SLOT = struct.Struct("<QQ")  # key hash (0 means empty), record offset
+# key length, value length, creation time, revision hash, access time. followed by key, value
+RECORD = struct.Struct("<IIdQd")
+# offset of the access time within a record
+RECORD_ACCESSED_OFFSET = RECORD.size - 8
+INITIAL_SLOT_COUNT = 64
+MAX_LOAD_FACTOR = 0.5
+# running totals of the whole store, so that the budget is checked without reading every shard
+TOTALS_FILENAME = "totals"
+TOTALS = struct.Struct("<QQ")  # live record bytes, live record count
+# eviction goes this far below the budget, so that it is not needed again on the next write
+EVICT_LOW_WATER = 0.9
+
+
+def make_empty_shard(slot_count: int) -> bytearray:
+    buf = bytearray(HEADER.size + (slot_count * SLOT.size))
+    HEADER.pack_into(buf, 0, MAGIC, VERSION, slot_count, 0, 0)
+    return buf
+
+
+class ShardedCacheStore:
+    """
+    key/value store spread over SHARD_COUNT binary files in one directory, sharded by hash of the key
+    each shard is memory mapped. a lookup is a hash probe and a slice, only the value found is decoded
+    misses are appended to the shard, and the shard is compacted once it has too many dead records
+    reads take a shared lock, writes take an exclusive lock
+    fetching a missing value is coordinated by a separate lock file per key
+    each record has a creation time. records older than timeout_seconds are stale, and records older
+    than timeout_seconds + stale_seconds are expired and treated as missing
+    if a revision is given, each record also has the revision it was written with. records of any other
+    revision are expired, and records of this revision never expire, no matter how old they are
+    if max_bytes or max_entries is given, least recently used records are evicted once the store is larger
+    the size of the store is kept as running totals in one small file, updated on every write
+    """
+
+    def __init__(
+        self,
+        path: str,
+        timeout_seconds: int,
+        stale_seconds: int = 0,
+        revision=None,
+        max_bytes: int = 0,
+        max_entries: int = 0,
+    ):
+        self.path = path
+        self.max_bytes = max_bytes
+        self.max_entries = max_entries
+        self.timeout_seconds = timeout_seconds
+        self.stale_seconds = stale_seconds
+        self.revision_hash = self._revision_hash(revision)
+        # value bytes read and record bytes written by this instance, for stats
+        self.bytes_read = 0
+        self.bytes_written = 0
+        if os.path.isfile(path):
+            # left behind by the old single-file cache format
+            os.remove(path)
+        os.makedirs(path, mode=0o700, exist_ok=True)
+        os.chmod(path, 0o700)
+
+    @staticmethod
+    def _digest(key: str) -> bytes:
+        return hashlib.sha256(key.encode()).digest()
+
+    @staticmethod
+    def _revision_hash(revision) -> int:
+        """
+        0 means no revision
+        """
+        if revision is None:
+            return 0
+        return int.from_bytes(hashlib.sha256(revision.encode()).digest()[:8], "little") | 1
+
+    def shard_path(self, key: str) -> str:
+        return os.path.join(self.path, f"{self._digest(key)[-1]:02x}.bin")
+
+    @staticmethod
+    def _is_valid(fd: int) -> bool:
+        if os.fstat(fd).st_size < HEADER.size:
+            return False
+        magic, version, _, _, _ = HEADER.unpack(os.pread(fd, HEADER.size, 0))
+        return magic == MAGIC and version == VERSION
+
+    @staticmethod
+    def _probe(buf, key_bytes: bytes, key_hash: int) -> tuple:
+        """
+        returns (slot number, record offset) for the key, or (first empty slot number, None) if missing
+        """
+        _, _, slot_count, _, _ = HEADER.unpack_from(buf, 0)
+        slot = key_hash % slot_count
+        while True:
+            slot_hash, offset = SLOT.unpack_from(buf, HEADER.size + (slot * SLOT.size))
+            if slot_hash == 0:
+                return slot, None
+            if slot_hash == key_hash:
+                key_len = RECORD.unpack_from(buf, offset)[0]
+                key_start = offset + RECORD.size
+                if buf[key_start : key_start + key_len] == key_bytes:
+                    return slot, offset
+            slot = (slot + 1) % slot_count
+
+    def _get_state(self, created: float, revision_hash: int) -> int:
+        if created == 0:
+            # deleted
+            return MISS
+        if self.revision_hash != 0:
+            return FRESH if revision_hash == self.revision_hash else MISS
+        age = time.time() - created
+        if age <= self.timeout_seconds:
+            return FRESH
+        if age <= self.timeout_seconds + self.stale_seconds:
+            return STALE
+        return MISS
+
+    def get(self, key: str) -> tuple:
+        """
+        returns (state, value, creation time). value and creation time are None if state is MISS
+        """
+        digest = self._digest(key)
+        key_hash = int.from_bytes(digest[:8], "little") | 1
+        try:
+            fd = os.open(self.shard_path(key), os.O_RDWR)
+        except FileNotFoundError:
+            return MISS, None, None
+        try:
+            fcntl.flock(fd, fcntl.LOCK_SH)
+            if not self._is_valid(fd):
+                return MISS, None, None
+            with mmap.mmap(fd, 0) as buf:
+                _, offset = self._probe(buf, key.encode(), key_hash)
+                if offset is None:
+                    return MISS, None, None
+                key_len, value_len, created, revision_hash, accessed = RECORD.unpack_from(buf, offset)
+                if (state := self._get_state(created, revision_hash)) == MISS:
+                    return MISS, None, None
+                if (now := time.time()) - accessed > ACCESS_TIME_RESOLUTION_SECONDS:
+                    # only a shared lock is held, but a lost update of the access time is harmless
+                    struct.pack_into("<d", buf, offset + RECORD_ACCESSED_OFFSET, now)
+                value_start = offset + RECORD.size + key_len
+                self.bytes_read += value_len
+                return state, json.loads(buf[value_start : value_start + value_len]), created
+        finally:
+            os.close(fd)
+
+    def _open_for_write(self, shard_path: str) -> int:
+        """
+        open the shard and take an exclusive lock
+        compaction replaces the shard file, so retry until the locked file is the current one
+        an invalid shard is reset to empty
+        """
+        while True:
+            fd = os.open(shard_path, os.O_RDWR | os.O_CREAT, 0o600)
+            fcntl.flock(fd, fcntl.LOCK_EX)
+            try:
+                if os.fstat(fd).st_ino == os.stat(shard_path).st_ino:
+                    break
+            except FileNotFoundError:
+                pass
+            os.close(fd)
+        if not self._is_valid(fd):
+            os.ftruncate(fd, 0)
+            os.pwrite(fd, make_empty_shard(INITIAL_SLOT_COUNT), 0)
+        return fd
+
+    def set(self, key: str, value, created=None) -> float:
+        """
+        returns the creation time of the new record, which is now unless given
+        """
+        digest = self._digest(key)
+        key_hash = int.from_bytes(digest[:8], "little") | 1
+        key_bytes = key.encode()
+        value_bytes = json.dumps(value).encode()
+        shard_path = self.shard_path(key)
+        fd = self._open_for_write(shard_path)
+        try:
+            offset = os.fstat(fd).st_size
+            if created is None:
+                created = time.time()
+            record = RECORD.pack(len(key_bytes), len(value_bytes), created, self.revision_hash, created)
+            os.pwrite(fd, record + key_bytes + value_bytes, offset)
+            self.bytes_written += len(record) + len(key_bytes) + len(value_bytes)
+            with mmap.mmap(fd, 0) as buf:
+                magic, version, slot_count, used, dead = HEADER.unpack_from(buf, 0)
+                slot, old_offset = self._probe(buf, key_bytes, key_hash)
+                SLOT.pack_into(buf, HEADER.size + (slot * SLOT.size), key_hash, offset)
+                # size of the record replaced by this one, if it is still in the running totals
+                replaced_size = 0
+                if old_offset is None:
+                    used += 1
+                else:
+                    old_key_len, old_value_len, old_created, _, _ = RECORD.unpack_from(buf, old_offset)
+                    dead += RECORD.size + old_key_len + old_value_len
+                    if old_created != 0:
+                        replaced_size = RECORD.size + old_key_len + old_value_len
+                HEADER.pack_into(buf, 0, magic, version, slot_count, used, dead)
+                needs_compaction = (used / slot_count) > MAX_LOAD_FACTOR or dead > (len(buf) / 2)
+            compacted_bytes = compacted_entries = 0
+            if needs_compaction:
+                compacted_bytes, compacted_entries = self._compact(fd, shard_path)
+        finally:
+            os.close(fd)
+        bytes_delta = len(record) + len(key_bytes) + len(value_bytes) - replaced_size - compacted_bytes
+        entries_delta = (0 if replaced_size else 1) - compacted_entries
+        if self._is_over_budget(*self._add_to_totals(bytes_delta, entries_delta)):
+            self.evict()
+        return created
+
+    def delete(self, key: str):
+        """
+        the record is marked as expired, and it is removed by the next compaction
+        """
+        digest = self._digest(key)
+        key_hash = int.from_bytes(digest[:8], "little") | 1
+        if not os.path.exists(shard_path := self.shard_path(key)):
+            return
+        fd = self._open_for_write(shard_path)
+        try:
+            with mmap.mmap(fd, 0) as buf:
+                _, offset = self._probe(buf, key.encode(), key_hash)
+                if offset is None:
+                    return
+                key_len, value_len, created, _, _ = RECORD.unpack_from(buf, offset)
+                RECORD.pack_into(buf, offset, key_len, value_len, 0, 0, 0)
+        finally:
+            os.close(fd)
+        if created != 0:
+            self._add_to_totals(-(RECORD.size + key_len + value_len), -1)
+
+    def _compact(self, fd: int, shard_path: str) -> tuple:
+        """
+        rewrite the shard without dead or expired records, with enough slots for the live records to be sparse
+        the caller must hold an exclusive lock on fd
+        returns (bytes, count) of the expired records which were removed, for the running totals
+        deleted records were already taken out of the totals when they were deleted
+        """
+        records = []
+        expired_bytes = 0
+        expired_entries = 0
+        with mmap.mmap(fd, 0, access=mmap.ACCESS_READ) as buf:
+            _, _, slot_count, _, _ = HEADER.unpack_from(buf, 0)
+            for slot in range(slot_count):
+                slot_hash, offset = SLOT.unpack_from(buf, HEADER.size + (slot * SLOT.size))
+                if slot_hash == 0:
+                    continue
+                key_len, value_len, created, revision_hash, _ = RECORD.unpack_from(buf, offset)
+                if self._get_state(created, revision_hash) == MISS:
+                    if created != 0:
+                        expired_bytes += RECORD.size + key_len + value_len
+                        expired_entries += 1
+                    continue
+                records.append((slot_hash, buf[offset : offset + RECORD.size + key_len + value_len]))
+        new_slot_count = INITIAL_SLOT_COUNT
+        while (len(records) / new_slot_count) > (MAX_LOAD_FACTOR / 2):
+            new_slot_count *= 2
+        new_shard = make_empty_shard(new_slot_count)
+        for slot_hash, record in records:
+            slot = slot_hash % new_slot_count
+            while SLOT.unpack_from(new_shard, HEADER.size + (slot * SLOT.size))[0] != 0:
+                slot = (slot + 1) % new_slot_count
+            SLOT.pack_into(new_shard, HEADER.size + (slot * SLOT.size), slot_hash, len(new_shard))
+            new_shard += record
+        HEADER.pack_into(new_shard, 0, MAGIC, VERSION, new_slot_count, len(records), 0)
+        tmp_path = f"{shard_path}.compact"
+        with open(os.open(tmp_path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600), "wb") as tmp_fd:
+            tmp_fd.write(new_shard)
+        os.replace(tmp_path, shard_path)
+        return expired_bytes, expired_entries
+
+    def _shard_paths(self) -> list:
+        return [entry.path for entry in os.scandir(self.path) if entry.name.endswith(".bin")]
+
+    def _count_live_records(self) -> tuple:
+        """
+        returns (bytes, count) of the live records in every shard
+        """
+        total_bytes = 0
+        total_entries = 0
+        for shard_path in self._shard_paths():
+            for _, size, _ in self._list_live_records(shard_path):
+                total_bytes += size
+                total_entries += 1
+        return total_bytes, total_entries
+
+    def _add_to_totals(self, bytes_delta: int, entries_delta: int) -> tuple:
+        """
+        add to the running totals and return them as (bytes, count)
+        a store without a totals file (new, or written by an older version) is counted once
+        the totals can drift from a killed process or a race with evict, and evict counts them again
+        """
+        fd = os.open(os.path.join(self.path, TOTALS_FILENAME), os.O_RDWR | os.O_CREAT, 0o600)
+        try:
+            fcntl.flock(fd, fcntl.LOCK_EX)
+            data = os.pread(fd, TOTALS.size, 0)
+            if len(data) == TOTALS.size:
+                total_bytes, total_entries = TOTALS.unpack(data)
+                total_bytes = max(total_bytes + bytes_delta, 0)
+                total_entries = max(total_entries + entries_delta, 0)
+            else:
+                # the delta is already in the shards
+                total_bytes, total_entries = self._count_live_records()
+            os.pwrite(fd, TOTALS.pack(total_bytes, total_entries), 0)
+        finally:
+            os.close(fd)
+        return total_bytes, total_entries
+
+    def _set_totals(self, total_bytes: int, total_entries: int):
+        fd = os.open(os.path.join(self.path, TOTALS_FILENAME), os.O_RDWR | os.O_CREAT, 0o600)
+        try:
+            fcntl.flock(fd, fcntl.LOCK_EX)
+            os.pwrite(fd, TOTALS.pack(total_bytes, total_entries), 0)
+        finally:
+            os.close(fd)
+
+    def _is_over_budget(self, total_bytes: int, total_entries: int) -> bool:
+        return (0 < self.max_bytes < total_bytes) or (0 < self.max_entries < total_entries)
+
+    def _list_live_records(self, shard_path: str) -> list:
+        """
+        returns [(access time, record size, key bytes), ...]
+        """
+        records = []
+        try:
+            fd = os.open(shard_path, os.O_RDONLY)
+        except FileNotFoundError:
+            return records
+        try:
+            fcntl.flock(fd, fcntl.LOCK_SH)
+            if not self._is_valid(fd):
+                return records
+            with mmap.mmap(fd, 0, access=mmap.ACCESS_READ) as buf:
+                _, _, slot_count, _, _ = HEADER.unpack_from(buf, 0)
+                for slot in range(slot_count):
+                    slot_hash, offset = SLOT.unpack_from(buf, HEADER.size + (slot * SLOT.size))
+                    if slot_hash == 0:
+                        continue
+                    key_len, value_len, created, revision_hash, accessed = RECORD.unpack_from(buf, offset)
+                    if self._get_state(created, revision_hash) == MISS:
+                        continue
+                    key_start = offset + RECORD.size
+                    key_bytes = bytes(buf[key_start : key_start + key_len])
+                    records.append((accessed, RECORD.size + key_len + value_len, key_bytes))
+        finally:
+            os.close(fd)
+        return records
+
+    def evict(self):
+        """
+        remove least recently used records until the live records fit within EVICT_LOW_WATER of max_bytes
+        and max_entries, then compact the shards which had records removed, and reset the running totals
+        the shards are locked one at a time, so this does not block the whole store
+        also removes fetch lock files left behind by older versions, which never removed them
+        """
+        remove_old_lock_files(self.path)
+        candidates = []
+        total_bytes = 0
+        for shard_path in self._shard_paths():
+            for accessed, size, key in self._list_live_records(shard_path):
+                candidates.append((accessed, size, key, shard_path))
+                total_bytes += size
+        total_entries = len(candidates)
+        victims = {}
+        candidates.sort(key=lambda x: x[0])
+        for accessed, size, key_bytes, shard_path in candidates:
+            over_bytes = self.max_bytes > 0 and total_bytes > self.max_bytes * EVICT_LOW_WATER
+            over_entries = self.max_entries > 0 and total_entries > self.max_entries * EVICT_LOW_WATER
+            if not (over_bytes or over_entries):
+                break
+            victims.setdefault(shard_path, []).append(key_bytes)
+            total_bytes -= size
+            total_entries -= 1
+        for shard_path, victim_keys in victims.items():
+            try:
+                fd = self._open_for_write(shard_path)
+            except FileNotFoundError:
+                continue
+            try:
+                with mmap.mmap(fd, 0) as buf:
+                    for key_bytes in victim_keys:
+                        key_hash = int.from_bytes(self._digest(key_bytes.decode())[:8], "little") | 1
+                        _, offset = self._probe(buf, key_bytes, key_hash)
+                        if offset is not None:
+                            key_len, value_len, _, _, _ = RECORD.unpack_from(buf, offset)
+                            RECORD.pack_into(buf, offset, key_len, value_len, 0, 0, 0)
+                self._compact(fd, shard_path)
+            finally:
+                os.close(fd)
+        self._set_totals(total_bytes, total_entries)
+
+    def get_or_fetch(self, key: str, func, wait=True, lower_tier=None) -> tuple:
+        """
+        single flight: concurrent misses on the same key wait for each other, and only one runs func
+        no shard lock is held while func runs, so hits on other keys are not blocked
+        if wait is False and another fork is already fetching this key, return (MISS, None, None) right away
+        lower_tier is a function of the key which returns (value, creation time) or None. it is tried before func,
+        and a value found there is copied into this store with its original creation time
+        returns (FRESH, value, creation time) if a fresh value was found, (PROMOTED, value, creation time)
+        if the value was found in the lower tier, (MISS, value, creation time) if func was run
+        """
+        lock_path = os.path.join(self.path, f"{self._digest(key).hex()}.lock")
+        if (fd := self._lock_fetch(lock_path, wait)) is None:
+            return MISS, None, None
+        try:
+            state, value, created = self.get(key)
+            if state == FRESH:
+                return FRESH, value, created
+            if lower_tier is not None and (found := lower_tier(key)) is not None:
+                value, created = found
+                self.set(key, value, created)
+                return PROMOTED, value, created
+            value = func()
+            created = self.set(key, value)
+        finally:
+            # removed while still locked. forks waiting on this file find that it is gone, and try again
+            try:
+                os.remove(lock_path)
+            except FileNotFoundError:
+                pass
+            os.close(fd)
+        return MISS, value, created
+
+    @staticmethod
+    def _lock_fetch(lock_path: str, wait: bool):
+        """
+        take an exclusive lock on the fetch lock file of a key, and return its fd
+        the file is removed after each fetch, so retry until the locked file is the current one
+        returns None if wait is False and another fork holds the lock
+        """
+        with stats.timed("lock_wait", lock="fetch"):
+            while True:
+                fd = os.open(lock_path, os.O_RDWR | os.O_CREAT, 0o600)
+                try:
+                    fcntl.flock(fd, fcntl.LOCK_EX if wait else fcntl.LOCK_EX | fcntl.LOCK_NB)
+                except BlockingIOError:
+                    os.close(fd)
+                    return None
+                try:
+                    if os.fstat(fd).st_ino == os.stat(lock_path).st_ino:
+                        return fd
+                except FileNotFoundError:
+                    pass
+                os.close(fd)
+
+    def size_bytes(self) -> int:
+        """
+        total size of the shard files
+        """
+        return sum(
+            entry.stat().st_size for entry in os.scandir(self.path) if entry.name.endswith(".bin")
+        )
+
+
+class BlobStore:
+    """
+    files in one directory named by the sha256 of their content, so identical content is stored once
+    """
+
+    def __init__(self, path: str, max_bytes: int = 0, max_entries: int = 0):
+        self.path = path
+        self.max_bytes = max_bytes
+        self.max_entries = max_entries
+        os.makedirs(path, mode=0o700, exist_ok=True)
+        os.chmod(path, 0o700)
+
+    def mkstemp(self) -> str:
+        """
+        make an empty temporary file in the store directory, to be added with add_file
+        """
+        fd, tmp_path = tempfile.mkstemp(dir=self.path, prefix="snap.bw.")
+        os.close(fd)
+        os.chmod(tmp_path, 0o600)
+        return tmp_path
+
+    def add_file(self, tmp_path: str) -> tuple:
+        """
+        move a file from mkstemp into the store, returns (sha256 hex digest, size)
+        """
+        sha256 = hashlib.sha256()
+        size = 0
+        with open(tmp_path, "rb") as fd:
+            while chunk := fd.read(BLOB_CHUNK_SIZE):
+                sha256.update(chunk)
+                size += len(chunk)
+        digest = sha256.hexdigest()
+        os.chmod(tmp_path, 0o600)
+        os.replace(tmp_path, self.blob_path(digest))
+        self.evict(keep=digest)
+        return digest, size
+
+    def evict(self, keep=None):
+        """
+        remove leftover temporary files, then, if the store is over max_bytes or max_entries, remove least
+        recently used blobs (other than `keep`) until it is within EVICT_LOW_WATER of them
+        the access time of a blob is its modification time, which read_base64 updates
+        """
+        remove_old_temp_files(self.path)
+        blobs = []
+        total_bytes = 0
+        for entry in os.scandir(self.path):
+            if entry.name.startswith("snap.bw.") or entry.name == keep:
+                continue
+            try:
+                stat = entry.stat()
+            except FileNotFoundError:
+                continue
+            blobs.append((stat.st_mtime, stat.st_size, entry.path))
+            total_bytes += stat.st_size
+        total_entries = len(blobs)
+        if keep is not None and os.path.exists(keep_path := self.blob_path(keep)):
+            total_bytes += os.stat(keep_path).st_size
+            total_entries += 1
+        if not ((0 < self.max_bytes < total_bytes) or (0 < self.max_entries < total_entries)):
+            return
+        blobs.sort()
+        for _, size, blob_path in blobs:
+            over_bytes = self.max_bytes > 0 and total_bytes > self.max_bytes * EVICT_LOW_WATER
+            over_entries = self.max_entries > 0 and total_entries > self.max_entries * EVICT_LOW_WATER
+            if not (over_bytes or over_entries):
+                break
+            try:
+                os.remove(blob_path)
+            except FileNotFoundError:
+                pass
+            total_bytes -= size
+            total_entries -= 1
+
+    def blob_path(self, digest: str) -> str:
+        return os.path.join(self.path, digest)
+
+    def read_base64(self, digest: str) -> str:
+        """
+        encode the blob in chunks rather than reading it into memory all at once
+        raises FileNotFoundError if there is no such blob
+        """
+        output = []
+        with open(self.blob_path(digest), "rb") as fd:
+            if time.time() - os.fstat(fd.fileno()).st_mtime > ACCESS_TIME_RESOLUTION_SECONDS:
+                os.utime(fd.fileno())
+            while chunk := fd.read(BLOB_CHUNK_SIZE):
+                output.append(base64.b64encode(chunk).decode())
+        return "".join(output)
+
+
+def remove_old_temp_files(path: str):
+    """
+    remove this user's temporary files of failed downloads from a directory
+    """
+    now = time.time()
+    for entry in os.scandir(path):
+        if not entry.name.startswith("snap.bw."):
+            continue
+        try:
+            stat = entry.stat()
+            if stat.st_uid == os.getuid() and (now - stat.st_mtime) > TEMP_MAX_AGE_SECONDS:
+                os.remove(entry.path)
+        except FileNotFoundError:
+            pass
+
+
+def remove_legacy_cache(path: str):
+    """
+    remove a cache file or directory at a path which is no longer used, if it belongs to this user
+    it is renamed first, so that only one fork removes it
+    """
+    try:
+        if os.lstat(path).st_uid != os.getuid():
+            return
+        removed_path = f"{path}.removed.{os.getpid()}"
+        os.rename(path, removed_path)
+    except FileNotFoundError:
+        return
+    if os.path.isdir(removed_path):
+        shutil.rmtree(removed_path)
+    else:
+        os.remove(removed_path)
+
+
+def remove_old_lock_files(path: str):
+    """
+    remove fetch lock files older than TEMP_MAX_AGE_SECONDS from a cache directory
+    a fetch which is still running past that only loses single flight, since the next fork makes a new lock file
+    """
+    now = time.time()
+    for entry in os.scandir(path):
+        if not entry.name.endswith(".lock"):
+            continue
+        try:
+            if (now - entry.stat().st_mtime) > TEMP_MAX_AGE_SECONDS:
+                os.remove(entry.path)
+        except FileNotFoundError:
+            pass
@@ -0,0 +1,118 @@
+import os
+import json
+import time
+import math
+
+from contextlib import contextmanager
+
+# set by the unity.bitwarden.stats callback in the controller process, and inherited by every fork
+# if it is not set, nothing is recorded
+STATS_PATH_ENV = "UNITY_BITWARDEN_STATS_PATH"
+
+# upper bounds of histogram buckets, in seconds
+SECONDS_BUCKETS = [0.001, 0.01, 0.1, 1, 10, math.inf]
+
+
+def is_enabled() -> bool:
+    return STATS_PATH_ENV in os.environ
+
+
+def record(event: str, **fields):
+    """
+    append one event to the stats file of this run
+    each event is one line written with one O_APPEND write, so events from different forks do not interleave
+    """
+    if (stats_path := os.environ.get(STATS_PATH_ENV)) is None:
+        return
+    line = json.dumps({"event": event, **fields}, separators=(",", ":")) + "\n"
+    try:
+        # no O_CREAT, the callback creates the file at the start of the run and removes it at the end
+        fd = os.open(stats_path, os.O_WRONLY | os.O_APPEND)
+    except OSError:
+        return
+    try:
+        os.write(fd, line.encode())
+    finally:
+        os.close(fd)
+
+
+@contextmanager
+def timed(event: str, **fields):
+    """
+    record an event with the number of seconds that the block took
+    """
+    if not is_enabled():
+        yield
+        return
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        record(event, seconds=time.perf_counter() - start, **fields)
+
+
+def percentile(sorted_values: list, fraction: float):
+    """
+    nearest rank percentile
+    """
+    rank = max(math.ceil(fraction * len(sorted_values)), 1)
+    return sorted_values[rank - 1]
+
+
+def make_histogram(values: list) -> dict:
+    sorted_values = sorted(values)
+    buckets = {}
+    remaining = sorted_values
+    for bound in SECONDS_BUCKETS:
+        count = 0
+        while count < len(remaining) and remaining[count] <= bound:
+            count += 1
+        buckets["+Inf" if bound == math.inf else str(bound)] = count
+        remaining = remaining[count:]
+    return {
+        "count": len(sorted_values),
+        "sum": sum(sorted_values),
+        "min": sorted_values[0],
+        "p50": percentile(sorted_values, 0.5),
+        "p99": percentile(sorted_values, 0.99),
+        "max": sorted_values[-1],
+        "buckets": buckets,
+    }
+
+
+def summarize(stats_path: str) -> dict:
+    """
+    aggregate the events in a stats file into counters and histograms
+    """
+    counters = {}
+    timings = {}
+    cache_bytes = 0
+    with open(stats_path, "r") as stats_fd:
+        for line in stats_fd:
+            try:
+                event = json.loads(line)
+            except ValueError:
+                # a fork was killed in the middle of a write
+                continue
+            name = event["event"]
+            if name == "cache":
+                counters[f"cache_{event['result']}"] = counters.get(f"cache_{event['result']}", 0) + 1
+                for key in ["bytes_read", "bytes_written"]:
+                    counters[key] = counters.get(key, 0) + event.get(key, 0)
+                if "cache_bytes" in event:
+                    cache_bytes = max(cache_bytes, event["cache_bytes"])
+                timings.setdefault("lookup", []).append(event["seconds"])
+                timings.setdefault(f"lookup {event['result']}", []).append(event["seconds"])
+            elif name == "lock_wait":
+                timings.setdefault(f"lock wait {event['lock']}", []).append(event["seconds"])
+            elif name == "bw":
+                timings.setdefault(f"bw {event['backend']} {event['command']}", []).append(event["seconds"])
+    lookups = sum(v for k, v in counters.items() if k.startswith("cache_"))
+    hits = sum(counters.get(f"cache_{x}", 0) for x in ["memory_hit", "hit", "stale_hit", "hit_after_wait", "persistent_hit"])
+    return {
+        "lookups": lookups,
+        "hit_ratio": (hits / lookups) if lookups else None,
+        "counters": counters,
+        "cache_bytes": cache_bytes,
+        "histograms": {name: make_histogram(values) for name, values in sorted(timings.items())},
+    }